@@ -1,94 +1,133 @@
 import argparse
+import mmap
+import os
+import sys
+from array import array
 from collections import defaultdict
+from functools import lru_cache
 
-def to_binary(string):
-    return bin(int(string, 10))[2:].zfill(15)
+C_INSTRUCTION = 0b111 << 13
+
+@lru_cache(maxsize=None)
+def to_text(word):
+    return f'{word:016b}\n'
+
+def write_binary(words, out, byteorder='little'):
+  rom = array('H', words)
+  if byteorder != sys.byteorder:
+    rom.byteswap()
+  rom.tofile(out)
+
+def load_hack(filename):
+  with open(filename, 'r') as f:
+    return array('H', [int(line, 2) for line in f if line.strip()])
+
+def load_binary(filename, byteorder='little'):
+  with open(filename, 'rb') as f:
+    if byteorder == sys.byteorder and os.fstat(f.fileno()).st_size:
+      # Zero-copy: the view keeps the mapping alive after the file is closed
+      return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast('H')
+    rom = array('H', f.read())
+  if byteorder != sys.byteorder:
+    rom.byteswap()
+  return rom
+
+def load_rom(filename, byteorder='little'):
+  if filename.endswith('.hack'):
+    return load_hack(filename)
+  return load_binary(filename, byteorder)
 
 class Assembler:
   def __init__(self):
     self.symbols = {
-      'R0': '0',
-      'R1': '1',
-      'R2': '2',
-      'R3': '3',
-      'R4': '4',
-      'R5': '5',
-      'R6': '6',
-      'R7': '7',
-      'R8': '8',
-      'R9': '9',
-      'R10': '10',
-      'R11': '11',
-      'R12': '12',
-      'R13': '13',
-      'R14': '14',
-      'R15': '15',
-      'SP': '0',
-      'LCL': '1',
-      'ARG': '2',
-      'THIS': '3',
-      'THAT': '4',
-      'SCREEN': '16384',
-      'KBD': '24576',
+      'R0': 0,
+      'R1': 1,
+      'R2': 2,
+      'R3': 3,
+      'R4': 4,
+      'R5': 5,
+      'R6': 6,
+      'R7': 7,
+      'R8': 8,
+      'R9': 9,
+      'R10': 10,
+      'R11': 11,
+      'R12': 12,
+      'R13': 13,
+      'R14': 14,
+      'R15': 15,
+      'SP': 0,
+      'LCL': 1,
+      'ARG': 2,
+      'THIS': 3,
+      'THAT': 4,
+      'SCREEN': 16384,
+      'KBD': 24576,
     }
     self.ram = 16
-    self.dests = defaultdict(lambda: '000', {
-      'M': '001',
-      'D': '010',
-      'DM': '011',
-      'A': '100',
-      'AM': '101',
-      'AD': '110',
-      'ADM': '111',
+    self.instructions = {}
+    self.dests = defaultdict(int, {
+      'M': 0b001 << 3,
+      'D': 0b010 << 3,
+      'DM': 0b011 << 3,
+      'MD': 0b011 << 3,
+      'A': 0b100 << 3,
+      'AM': 0b101 << 3,
+      'MA': 0b101 << 3,
+      'AD': 0b110 << 3,
+      'DA': 0b110 << 3,
+      'ADM': 0b111 << 3,
+      'AMD': 0b111 << 3,
     })
     self.comps = {
-      '0': '0101010',
-      '1': '0111111',
-      '-1': '0111010',
-      'D': '0001100',
-      'A': '0110000',
-      '!D': '0001101',
-      '!A': '0110001',
-      '-D': '0001111',
-      '-A': '0110011',
-      'D+1': '0011111',
-      'A+1': '0110111',
-      'D-1': '0001110',
-      'A-1': '0110010',
-      'D+A': '0000010',
-      'D-A': '0010011',
-      'A-D': '0000111',
-      'D&A': '0000000',
-      'D|A': '0010101',
-      'M': '1110000',
-      '!M': '1110001',
-      '-M': '1110011',
-      'M+1': '1110111',
-      'M-1': '1110010',
-      'D+M': '1000010',
-      'D-M': '1010011',
-      'M-D': '1000111',
-      'D&M': '1000000',
-      'D|M': '1010101',
+      '0': 0b0101010 << 6,
+      '1': 0b0111111 << 6,
+      '-1': 0b0111010 << 6,
+      'D': 0b0001100 << 6,
+      'A': 0b0110000 << 6,
+      '!D': 0b0001101 << 6,
+      '!A': 0b0110001 << 6,
+      '-D': 0b0001111 << 6,
+      '-A': 0b0110011 << 6,
+      'D+1': 0b0011111 << 6,
+      'A+1': 0b0110111 << 6,
+      'D-1': 0b0001110 << 6,
+      'A-1': 0b0110010 << 6,
+      'D+A': 0b0000010 << 6,
+      'D-A': 0b0010011 << 6,
+      'A-D': 0b0000111 << 6,
+      'D&A': 0b0000000 << 6,
+      'D|A': 0b0010101 << 6,
+      'M': 0b1110000 << 6,
+      '!M': 0b1110001 << 6,
+      '-M': 0b1110011 << 6,
+      'M+1': 0b1110111 << 6,
+      'M-1': 0b1110010 << 6,
+      'D+M': 0b1000010 << 6,
+      'D-M': 0b1010011 << 6,
+      'M-D': 0b1000111 << 6,
+      'D&M': 0b1000000 << 6,
+      'D|M': 0b1010101 << 6,
     }
-    self.jumps = defaultdict(lambda: '000', {
-      'JGT': '001',
-      'JEQ': '010',
-      'JGE': '011',
-      'JLT': '100',
-      'JNE': '101',
-      'JLE': '110',
-      'JMP': '111',
+    self.jumps = defaultdict(int, {
+      'JGT': 0b001,
+      'JEQ': 0b010,
+      'JGE': 0b011,
+      'JLT': 0b100,
+      'JNE': 0b101,
+      'JLE': 0b110,
+      'JMP': 0b111,
     })
 
-  def parse(self, filename: str):
-    outfile = filename.replace('.asm', '.hack')
-    with open(filename, 'r') as f:
-      self.parse_labels(f)
+  def parse(self, filename: str, format='hack', byteorder='little'):
     with open(filename, 'r') as f:
-      with open(outfile, 'w') as out:
-        for result in self.parse_file(f):
-          out.write(f'{result}\n')
+      words = self.parse_file(f)
+    if format == 'bin':
+      with open(filename.replace('.asm', '.bin'), 'wb') as out:
+        write_binary(words, out, byteorder)
+    else:
+      with open(filename.replace('.asm', '.hack'), 'w') as out:
+        out.writelines(map(to_text, words))
 
   def prep_line(self, line):
     if '//' in line:
@@ -96,47 +135,55 @@ class Assembler:
     line = line.strip()
     return line
 
-  def parse_labels(self, f):
-    number = 1
-    for line in f:
-      line = self.prep_line(line)
-      if not line or line.startswith('//'):
-        continue
-      if line.startswith('('):
-        self.symbols[line[1:-1]] = f'{number-1}'
-      else:
-        number += 1
-
   def parse_file(self, f):
+    words = []
+    fixups = {}
     for line in f:
       line = self.prep_line(line)
-      if not line or line.startswith('//') or line.startswith('('):
+      if not line:
         continue
-      if line.startswith('@'):
-        yield self.parse_A(line)
+      if line[0] == '(':
+        label = line[1:-1]
+        self.symbols[label] = len(words)
+        for i in fixups.pop(label, []):
+          words[i] = len(words)
+      elif line[0] == '@':
+        words.append(self.parse_A(line[1:], len(words), fixups))
       else:
-        yield self.parse_C(line)
+        words.append(self.parse_C(line))
+    # Whatever is still unresolved is a variable, allocated in order of first use
+    for symbol, references in fixups.items():
+      self.symbols[symbol] = self.ram
+      for i in references:
+        words[i] = self.ram
+      self.ram += 1
+    return words
 
-  def parse_A(self, line):
-    symbol = line[1:]
+  def parse_A(self, symbol, number, fixups):
     if symbol[0].isdigit():
-      return f'0{to_binary(symbol)}'
-    if symbol not in self.symbols:
-      self.symbols[symbol] = f'{self.ram}'
-      self.ram += 1
-    return f'0{to_binary(self.symbols[symbol])}'
+      return int(symbol)
+    if symbol in self.symbols:
+      return self.symbols[symbol]
+    fixups.setdefault(symbol, []).append(number)
+    return 0
 
   def parse_C(self, line):
+    if line in self.instructions:
+      return self.instructions[line]
     dest, comp, jump = '', line, ''
     if '=' in comp:
       dest, comp = comp.split('=')
     if ';' in comp:
       comp, jump = comp.split(';')
-    return f'111{self.comps[comp]}{self.dests[dest]}{self.jumps[jump]}'
+    word = C_INSTRUCTION | self.comps[comp] | self.dests[dest] | self.jumps[jump]
+    self.instructions[line] = word
+    return word
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Assembler')
   parser.add_argument('filename', help='input file')
+  parser.add_argument('--format', choices=['hack', 'bin'], default='hack', help='text .hack or packed 16-bit .bin output')
+  parser.add_argument('--byteorder', choices=['little', 'big'], default='little', help='word byte order for .bin output')
   args = parser.parse_args()
   assembler = Assembler()
-  assembler.parse(args.filename)
\ No newline at end of file
+  assembler.parse(args.filename, args.format, args.byteorder)
\ No newline at end of file
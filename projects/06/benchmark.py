@@ -0,0 +1,42 @@
+import argparse
+import io
+import os
+import time
+
+from assembler import Assembler, to_text, write_binary
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def encode(lines):
+  # A fresh assembler each time, since the symbol table fills up
+  return Assembler().parse_file(lines)
+
+def hack(lines):
+  return ''.join(map(to_text, encode(lines)))
+
+def binary(lines):
+  out = io.BytesIO()
+  write_binary(encode(lines), out)
+  return out.getvalue()
+
+def best(function, lines, repeat):
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function(lines)
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Hack assembler benchmark')
+  parser.add_argument('filename', nargs='?', default=os.path.join(HERE, 'pong', 'Pong.asm'), help='.asm file, by default pong/Pong.asm')
+  parser.add_argument('--repeat', type=int, default=20, help='report the best of this many runs')
+  args = parser.parse_args()
+  # Read once, so only encoding and formatting are timed
+  with open(args.filename) as f:
+    lines = f.readlines()
+  words = encode(lines)
+  print(f'{args.filename}: {len(lines)} lines, {len(words)} instructions, best of {args.repeat}')
+  for name, function in [('parse_file', encode), ('parse_file + .hack text', hack), ('parse_file + .bin', binary)]:
+    elapsed = best(function, lines, args.repeat)
+    print(f'{name}: {elapsed * 1e3:.1f} ms ({len(words) / elapsed / 1e6:.2f}M instructions/s)')
@@ -0,0 +1,208 @@
+import argparse
+import time
+from array import array
+
+from assembler import Assembler, load_rom
+
+ROM_SIZE = 32768
+RAM_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+
+def alu(bits):
+  # Generic ALU for comp fields outside the standard instruction set
+  zx, nx, zy, ny, f, no = [(bits >> i) & 1 for i in range(5, -1, -1)]
+  x = '0' if zx else 'd'
+  y = '0' if zy else 'y'
+  if nx:
+    x = f'~{x}'
+  if ny:
+    y = f'~{y}'
+  out = f'({x} + {y})' if f else f'({x} & {y})'
+  return f'~{out}' if no else out
+
+def build_expressions():
+  expressions = {}
+  for mnemonic, bits in Assembler().comps.items():
+    expression = mnemonic.replace('!', '~').replace('D', 'd').replace('A', 'a').replace('M', 'm')
+    expressions[bits >> 6] = expression
+  for bits in range(128):
+    if bits not in expressions:
+      expressions[bits] = alu(bits & 0b111111).replace('y', 'm' if bits & 0b1000000 else 'a')
+  return expressions
+
+def build_computations():
+  return {
+    bits: eval(f'lambda d, a, m: ({expression}) & 0xFFFF')
+    for bits, expression in build_expressions().items()
+  }
+
+class CPU:
+  def __init__(self, rom):
+    self.computations = build_computations()
+    self.program = [self.decode(word) for word in rom]
+    self.program += [0] * (ROM_SIZE - len(self.program))
+    self.ram = array('H', bytes(2 * RAM_SIZE))
+    self.reset()
+
+  def reset(self):
+    self.a = 0
+    self.d = 0
+    self.pc = 0
+    self.cycles = 0
+
+  def decode(self, word):
+    # A-instructions decode to their value, C-instructions to a tuple of
+    # (computation, reads M, writes A, writes D, writes M, jump table)
+    if not word & 0x8000:
+      return word
+    bits = (word >> 6) & 0b1111111
+    jump = word & 0b111
+    return (
+      self.computations[bits],
+      bool(bits & 0b1000000),
+      bool(word & 0b100000),
+      bool(word & 0b010000),
+      bool(word & 0b001000),
+      # Indexed by the sign of the result: zero, positive, negative
+      (bool(jump & 0b010), bool(jump & 0b001), bool(jump & 0b100)) if jump else None,
+    )
+
+  def run(self, cycles):
+    program, ram = self.program, self.ram
+    a, d, pc = self.a, self.d, self.pc
+    for _ in range(cycles):
+      instruction = program[pc]
+      if instruction.__class__ is int:
+        a = instruction
+        pc += 1
+        continue
+      compute, reads, to_a, to_d, to_m, jump = instruction
+      # RAM is 32K words, so M only sees the low 15 bits of A
+      out = compute(d, a, ram[a & 0x7FFF] if reads else 0)
+      if to_m:
+        ram[a & 0x7FFF] = out
+      if jump and jump[0 if not out else 2 if out & 0x8000 else 1]:
+        pc = a & 0x7FFF
+      else:
+        pc += 1
+      if to_a:
+        a = out
+      if to_d:
+        d = out
+    self.a, self.d, self.pc = a, d, pc
+    self.cycles += cycles
+
+  def peek(self, address):
+    value = self.ram[address]
+    return value - 0x10000 if value & 0x8000 else value
+
+  def poke(self, address, value):
+    self.ram[address] = value & 0xFFFF
+
+JUMPS = {
+  0b001: '0 < out < 0x8000',
+  0b010: 'out == 0',
+  0b011: 'out < 0x8000',
+  0b100: 'out >= 0x8000',
+  0b101: 'out != 0',
+  0b110: 'out == 0 or out >= 0x8000',
+  0b111: 'True',
+}
+MAX_BLOCK = 256
+# Computations that can never leave the 16-bit range
+WORDS = set(['0', '1', 'd', 'a', 'm', 'd&a', 'd|a', 'd&m', 'd|m'])
+
+class BlockCPU(CPU):
+  # Compiles each run of straight-line code ending in a jump into one
+  # Python function, cached by the ROM address it starts at
+  def __init__(self, rom):
+    self.rom = list(rom) + [0] * (ROM_SIZE - len(rom))
+    self.expressions = build_expressions()
+    self.blocks = [None] * ROM_SIZE
+    super().__init__(rom)
+
+  def compile(self, start):
+    lines = ['def block(ram, a, d):']
+    address = None # Value of A when it is known at compile time
+    pc = start
+    while pc < ROM_SIZE and pc - start < MAX_BLOCK:
+      word = self.rom[pc]
+      pc += 1
+      if not word & 0x8000:
+        lines.append(f'  a = {word}')
+        address = word
+        continue
+      m = f'ram[{address}]' if address is not None else 'ram[a & 0x7FFF]'
+      expression = self.expressions[(word >> 6) & 0b1111111]
+      if expression in WORDS:
+        value = expression.replace('m', m)
+      else:
+        value = f'({expression.replace("m", m)}) & 0xFFFF'
+      jump = word & 0b111
+      dests = [m] if word & 0b001000 else []
+      if word & 0b010000:
+        dests.append('d')
+      if jump:
+        lines.append(f'  out = {value}')
+        value = 'out'
+        if address is None:
+          lines.append('  target = a & 0x7FFF')
+      if word & 0b100000:
+        dests.append('a')
+      if dests:
+        lines.append(f'  {" = ".join(dests)} = {value}')
+      if jump:
+        target = address if address is not None else 'target'
+        if jump == 0b111:
+          lines.append(f'  return {target}, a, d')
+        else:
+          lines.append(f'  return ({target} if {JUMPS[jump]} else {pc}), a, d')
+        break
+      if word & 0b100000:
+        address = None
+    else:
+      lines.append(f'  return {pc & 0x7FFF}, a, d')
+    namespace = {}
+    exec(compile('\n'.join(lines), f'<block {start}>', 'exec'), namespace)
+    return namespace['block'], pc - start
+
+  def run(self, cycles):
+    blocks, ram = self.blocks, self.ram
+    a, d, pc = self.a, self.d, self.pc
+    remaining = cycles
+    while remaining > 0:
+      block = blocks[pc]
+      if block is None:
+        block = blocks[pc] = self.compile(pc)
+      function, length = block
+      if length > remaining:
+        break
+      pc, a, d = function(ram, a, d)
+      remaining -= length
+    self.a, self.d, self.pc = a, d, pc
+    self.cycles += cycles - remaining
+    if remaining:
+      # Finish a partial block one instruction at a time
+      super().run(remaining)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='CPU Emulator')
+  parser.add_argument('filename', help='.hack or .bin program')
+  parser.add_argument('--cycles', type=int, default=1000000, help='number of instructions to execute')
+  parser.add_argument('--set', nargs='*', default=[], metavar='ADDRESS=VALUE', help='initial RAM values')
+  parser.add_argument('--dump', nargs='*', type=int, default=[], metavar='ADDRESS', help='RAM addresses to print after the run')
+  parser.add_argument('--jit', action='store_true', help='compile basic blocks into Python functions')
+  parser.add_argument('--time', action='store_true', help='report execution speed')
+  args = parser.parse_args()
+  cpu = (BlockCPU if args.jit else CPU)(load_rom(args.filename))
+  for assignment in args.set:
+    address, value = assignment.split('=')
+    cpu.poke(int(address), int(value))
+  start = time.perf_counter()
+  cpu.run(args.cycles)
+  elapsed = time.perf_counter() - start
+  if args.time:
+    print(f'{cpu.cycles} instructions in {elapsed:.2f}s ({cpu.cycles / elapsed / 1e6:.2f}M/s)')
+  for address in args.dump:
+    print(f'RAM[{address}] = {cpu.peek(address)}')
@@ -0,0 +1,63 @@
+import glob
+import os
+import shutil
+import sys
+
+import pytest
+
+from assembler import Assembler, load_binary, load_hack, load_rom, write_binary
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECTS = os.path.dirname(HERE)
+ROMS = sorted(
+  glob.glob(os.path.join(PROJECTS, '05', '*.hack')) + glob.glob(os.path.join(PROJECTS, '05', '*.bin')) +
+  glob.glob(os.path.join(HERE, '*', '*.hack')) + glob.glob(os.path.join(HERE, '*', '*.bin'))
+)
+SOURCES = sorted(glob.glob(os.path.join(HERE, '*', '*.asm')))
+BYTEORDERS = ['little', 'big']
+
+def name(path):
+  return os.path.relpath(path, PROJECTS)
+
+@pytest.mark.parametrize('byteorder', BYTEORDERS)
+@pytest.mark.parametrize('rom', ROMS, ids=name)
+def test_committed_rom_round_trip(rom, byteorder, tmp_path):
+  words = list(load_rom(rom))
+  assert words
+  out = tmp_path / 'rom.bin'
+  with open(out, 'wb') as f:
+    write_binary(words, f, byteorder)
+  assert out.stat().st_size == 2 * len(words)
+  loaded = load_binary(str(out), byteorder)
+  # Native order is mapped in place, the other order is read and swapped
+  assert isinstance(loaded, memoryview) == (byteorder == sys.byteorder)
+  assert list(loaded) == words
+
+@pytest.mark.parametrize('byteorder', BYTEORDERS)
+@pytest.mark.parametrize('source', SOURCES, ids=name)
+def test_assemble_binary(source, byteorder, tmp_path):
+  asm = tmp_path / os.path.basename(source)
+  shutil.copy(source, asm)
+  Assembler().parse(str(asm), 'bin', byteorder)
+  Assembler().parse(str(asm), 'hack')
+  expected = list(load_hack(source.replace('.asm', '.hack')))
+  assert list(load_hack(str(asm).replace('.asm', '.hack'))) == expected
+  assert list(load_rom(str(asm).replace('.asm', '.bin'), byteorder)) == expected
+
+def test_byte_orders_differ(tmp_path):
+  words = [0x1234, 0xFFFF, 0x0000, 0x8001]
+  for byteorder in BYTEORDERS:
+    with open(tmp_path / f'{byteorder}.bin', 'wb') as f:
+      write_binary(words, f, byteorder)
+  little = (tmp_path / 'little.bin').read_bytes()
+  big = (tmp_path / 'big.bin').read_bytes()
+  assert little == b'\x34\x12\xff\xff\x00\x00\x01\x80'
+  assert big == b'\x12\x34\xff\xff\x00\x00\x80\x01'
+
+def test_empty_binary(tmp_path):
+  # mmap cannot map an empty file, so it is read instead
+  for byteorder in BYTEORDERS:
+    out = tmp_path / f'{byteorder}.bin'
+    with open(out, 'wb') as f:
+      write_binary([], f, byteorder)
+    assert list(load_binary(str(out), byteorder)) == []
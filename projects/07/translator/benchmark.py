@@ -0,0 +1,85 @@
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+from translator import CodeWriter, StackCachingWriter, Parser, translate_file
+
+SEGMENTS = ['local', 'argument', 'this', 'that', 'temp', 'pointer', 'static']
+
+def generate(count, filename, seed=1):
+  # Functions of 200 random commands: mostly pushes, pops and arithmetic,
+  # with some labels, jumps, calls and returns
+  rng = random.Random(seed)
+  lines = []
+  functions = 0
+  while len(lines) < count:
+    lines.append(f'function Big.f{functions} 3')
+    functions += 1
+    for i in range(200):
+      r = rng.random()
+      if r < 0.35:
+        lines.append(f'push constant {rng.randint(0, 100)}')
+      elif r < 0.7:
+        segment = rng.choice(SEGMENTS)
+        index = rng.randint(0, 1) if segment == 'pointer' else rng.randint(0, 7)
+        lines.append(f'{"push" if r < 0.55 else "pop"} {segment} {index}')
+      elif r < 0.85:
+        lines.append(rng.choice(['add', 'sub', 'neg', 'not', 'and', 'or', 'eq', 'lt', 'gt']))
+      elif r < 0.9:
+        lines.append(f'label L{i}')
+      elif r < 0.93:
+        lines.append(f'if-goto L{i}')
+      elif r < 0.95:
+        lines.append(f'goto L{i}')
+      elif r < 0.98:
+        lines.append(f'call Big.f{rng.randint(0, functions)} 2')
+      else:
+        lines.append('return')
+  with open(filename, 'w') as f:
+    f.write('\n'.join(lines[:count]) + '\n')
+
+def emit(filename, commands, optimize, shared_calls, stack_caching):
+  # What translate_file does once the commands are parsed
+  writer = (StackCachingWriter if stack_caching else CodeWriter)(io.StringIO(), optimize, shared_calls)
+  writer.setFileName(filename)
+  for command in commands:
+    writer.writeText(command.comment + '\n')
+    writer.handlers[command.type](command)
+  writer.flush()
+
+def best(function, repeat):
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='VM translator benchmark')
+  parser.add_argument('filename', nargs='?', help='.vm file, by default a generated one')
+  parser.add_argument('--lines', type=int, default=1000000, help='VM lines in the generated file')
+  parser.add_argument('--repeat', type=int, default=3, help='report the best of this many runs')
+  parser.add_argument('--optimize', action='store_true', help='run peephole optimizations over the generated assembly')
+  parser.add_argument('--shared-calls', action='store_true', help='route call and return through one shared routine each')
+  parser.add_argument('--stack-caching', action='store_true', help='keep the top of the stack in D between VM commands')
+  args = parser.parse_args()
+  options = (args.optimize, args.shared_calls, args.stack_caching)
+  with tempfile.TemporaryDirectory() as directory:
+    filename = args.filename
+    if filename is None:
+      filename = os.path.join(directory, 'Big.vm')
+      generate(args.lines, filename)
+    commands = list(Parser(filename))
+    print(f'{filename}: {len(commands)} lines, best of {args.repeat}')
+    timings = [
+      ('parse', lambda: list(Parser(filename))),
+      ('emit (parsed commands)', lambda: emit(filename, commands, *options)),
+      ('translate_file', lambda: translate_file(filename, *options)),
+    ]
+    for name, function in timings:
+      elapsed = best(function, args.repeat)
+      print(f'{name}: {elapsed:.2f} s ({len(commands) / elapsed / 1e3:.0f}k lines/s)')
@@ -1,5 +1,7 @@
 class CodeBuilder:
-  def __init__(self):
+  def __init__(self, namespace=''):
+    # Prefix for generated labels, so files can be translated independently
+    self.namespace = namespace
     self.counter = 0
     self.jumps = {
       'eq': 'JEQ',
@@ -134,7 +136,7 @@ class CodeBuilder:
       'D;JNE',
     ]
   def arithmetic(self, command):   
-    label = f'{command}{self.counter}'
+    label = f'{self.namespace}${command}{self.counter}'
     if command in self.operations:
       return [
         *self._pop_no_set(),
@@ -169,7 +171,7 @@ class CodeBuilder:
       result += self.push_constant(0)
     return result
   def call(self, name, n_args):
-    label = f'return_{name}_{self.counter}'
+    label = f'{self.namespace}$return_{name}_{self.counter}'
     result = [
         *self._access_value('SP'),
         *self._set_value('R13'),
@@ -196,6 +198,26 @@ class CodeBuilder:
     ]
     self.counter += 1
     return result
+  def call_shared(self, name, n_args):
+    # Only the call-specific registers are set up here, $$CALL builds the frame
+    label = f'{self.namespace}$return_{name}_{self.counter}'
+    self.counter += 1
+    return [
+      *self._create_constant(n_args),
+      *self._set_value('R13'),
+      *self._create_constant(name),
+      *self._set_value('R14'),
+      f'@{label}',
+      'D=A',
+      '@$$CALL',
+      '0;JMP',
+      *self.create_label(label),
+    ]
+  def return_shared(self):
+    return [
+      '@$$RETURN',
+      '0;JMP',
+    ]
   def build_return(self):
     return [
       *self._access_value('LCL'),
@@ -223,6 +245,111 @@ class CodeBuilder:
       'A=M',
       '0;JMP',
     ]
+  def trampolines(self):
+    return [
+      # R13 = nArgs, R14 = callee, D = return address
+      *self.create_label('$$CALL'),
+      *self._push_stack(),
+      *self.push_memory('LCL'),
+      *self.push_memory('ARG'),
+      *self.push_memory('THIS'),
+      *self.push_memory('THAT'),
+      *self._access_value('R13'),
+      '@5',
+      'D=D+A',
+      '@SP',
+      'D=M-D',
+      *self._set_value('ARG'),
+      *self._access_value('SP'),
+      *self._set_value('LCL'),
+      '@R14',
+      'A=M',
+      '0;JMP',
+      *self.create_label('$$RETURN'),
+      *self.build_return(),
+    ]
+  # Stack caching: the top of the stack lives in D instead of RAM[SP-1]
+  def spill(self):
+    return [
+      '@SP',
+      'M=M+1',
+      'A=M-1',
+      'M=D',
+    ]
+  def load_top(self):
+    return [
+      '@SP',
+      'AM=M-1',
+      'D=M',
+    ]
+  def load_constant(self, constant):
+    return self._create_constant(constant)
+  def load_memory(self, address, index=None):
+    if index is None:
+      return self._access_value(address)
+    if index == '0':
+      return [
+        f'@{address}',
+        'A=M',
+        'D=M',
+      ]
+    return [
+      f'@{address}',
+      'D=M',
+      f'@{index}',
+      'A=D+A',
+      'D=M',
+    ]
+  def store_memory(self, address):
+    return self._set_value(address)
+  def store_to_address(self, base, offset):
+    if int(offset) <= 6:
+      return [
+        f'@{base}',
+        'A=M',
+        *['A=A+1'] * int(offset),
+        'M=D',
+      ]
+    return [
+      *self._set_value('R13'),
+      *self._get_address(base, offset),
+      *self._set_value('R14'),
+      *self._access_value('R13'),
+      '@R14',
+      'A=M',
+      'M=D',
+    ]
+  def arithmetic_top(self, command):
+    if command in self.operations:
+      return [
+        self.operations[command].replace('M', 'D'),
+      ]
+    if command in self.jumps:
+      label = f'{self.namespace}${command}{self.counter}'
+      end = f'{self.namespace}${command}_end{self.counter}'
+      self.counter += 1
+      return [
+        '@SP',
+        'AM=M-1',
+        'D=M-D',
+        f'@{label}',
+        f'D;{self.jumps[command]}',
+        'D=0',
+        *self.goto(end),
+        *self.create_label(label),
+        'D=-1',
+        *self.create_label(end),
+      ]
+    return [
+      '@SP',
+      'AM=M-1',
+      self.operators[command].replace('M=', 'D=', 1),
+    ]
+  def if_goto_top(self, label):
+    return [
+      f'@{label}',
+      'D;JNE',
+    ]
   def bootstrap(self):
     return [
       *self._create_constant(256+5),
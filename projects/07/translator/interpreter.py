@@ -0,0 +1,211 @@
+import argparse
+import os
+from array import array
+
+from translator import Parser, C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL, C_RETURN
+
+# Resolved instructions
+PUSH_CONSTANT, PUSH_SEGMENT, PUSH_FIXED, POP_SEGMENT, POP_FIXED = range(5)
+ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT = range(5, 14)
+GOTO, IF_GOTO, FUNCTION, CALL, RETURN = range(14, 19)
+
+SP, LCL, ARG, THIS, THAT = range(5)
+RAM_SIZE = 32768
+
+def wrap(value):
+  return (value + 0x8000) % 0x10000 - 0x8000
+
+class Interpreter:
+  def __init__(self, paths):
+    self.locations = {
+      'local': LCL,
+      'argument': ARG,
+      'this': THIS,
+      'that': THAT,
+    }
+    self.operations = {
+      'add': ADD,
+      'sub': SUB,
+      'neg': NEG,
+      'eq': EQ,
+      'gt': GT,
+      'lt': LT,
+      'and': AND,
+      'or': OR,
+      'not': NOT,
+    }
+    self.statics = {}
+    self.functions = {}
+    self.labels = {}
+    self.program = []
+    for path in paths:
+      if path.endswith('.vm'):
+        self.load(path)
+      else:
+        for file in sorted(os.listdir(path)):
+          if file.endswith('.vm'):
+            self.load(os.path.join(path, file))
+    # Loop forever once the program runs off its end, like the translator's END
+    self.labels['$END'] = len(self.program)
+    self.program.append((GOTO, '$END'))
+    self.program = [self.resolve(*instruction) for instruction in self.program]
+    self.ram = array('h', bytes(2 * RAM_SIZE))
+    # Return indices can exceed 16 bits, so they are kept here rather than
+    # in the frame's return address word, which is left 0
+    self.returns = []
+    self.pc = 0
+    self.steps = 0
+    if 'Sys.init' in self.functions:
+      self.pc = len(self.program)
+      self.program.append((CALL, self.functions['Sys.init'], 0))
+      self.ram[SP] = 256
+
+  def address(self, filename, segment, index):
+    if segment == 'pointer':
+      return THIS + index
+    if segment == 'temp':
+      return 5 + index
+    key = (filename, index)
+    if key not in self.statics:
+      self.statics[key] = 16 + len(self.statics)
+    return self.statics[key]
+
+  def load(self, filename):
+    name = os.path.basename(filename).replace('.vm', '')
+    function = ''
+    for command in Parser(filename):
+      if command.type == C_ARITHMETIC:
+        self.program.append((self.operations[command.arg1],))
+      elif command.type == C_PUSH or command.type == C_POP:
+        segment, index = command.arg1, int(command.arg2)
+        if segment == 'constant':
+          self.program.append((PUSH_CONSTANT, index))
+        elif segment in self.locations:
+          self.program.append((PUSH_SEGMENT if command.type == C_PUSH else POP_SEGMENT, self.locations[segment], index))
+        else:
+          self.program.append((PUSH_FIXED if command.type == C_PUSH else POP_FIXED, self.address(name, segment, index)))
+      elif command.type == C_LABEL:
+        self.labels[f'{function}${command.arg1}'] = len(self.program)
+      elif command.type == C_GOTO:
+        self.program.append((GOTO, f'{function}${command.arg1}'))
+      elif command.type == C_IF:
+        self.program.append((IF_GOTO, f'{function}${command.arg1}'))
+      elif command.type == C_FUNCTION:
+        function = command.arg1
+        self.functions[function] = len(self.program)
+        self.program.append((FUNCTION, int(command.arg2)))
+      elif command.type == C_CALL:
+        self.program.append((CALL, command.arg1, int(command.arg2)))
+      elif command.type == C_RETURN:
+        self.program.append((RETURN,))
+
+  def resolve(self, opcode, *args):
+    # Replace label and function names with instruction indices
+    if opcode == GOTO or opcode == IF_GOTO:
+      return (opcode, self.labels[args[0]])
+    if opcode == CALL:
+      return (opcode, self.functions[args[0]], args[1])
+    return (opcode, *args)
+
+  def run(self, steps):
+    program, ram, returns = self.program, self.ram, self.returns
+    pc = self.pc
+    for _ in range(steps):
+      instruction = program[pc]
+      opcode = instruction[0]
+      pc += 1
+      if opcode == PUSH_CONSTANT:
+        sp = ram[SP]
+        ram[sp] = instruction[1]
+        ram[SP] = sp + 1
+      elif opcode == PUSH_SEGMENT:
+        sp = ram[SP]
+        ram[sp] = ram[ram[instruction[1]] + instruction[2]]
+        ram[SP] = sp + 1
+      elif opcode == PUSH_FIXED:
+        sp = ram[SP]
+        ram[sp] = ram[instruction[1]]
+        ram[SP] = sp + 1
+      elif opcode == POP_SEGMENT:
+        sp = ram[SP] - 1
+        ram[ram[instruction[1]] + instruction[2]] = ram[sp]
+        ram[SP] = sp
+      elif opcode == POP_FIXED:
+        sp = ram[SP] - 1
+        ram[instruction[1]] = ram[sp]
+        ram[SP] = sp
+      elif opcode == IF_GOTO:
+        sp = ram[SP] - 1
+        ram[SP] = sp
+        if ram[sp]:
+          pc = instruction[1]
+      elif opcode == GOTO:
+        pc = instruction[1]
+      elif opcode == NEG:
+        sp = ram[SP] - 1
+        ram[sp] = wrap(-ram[sp])
+      elif opcode == NOT:
+        sp = ram[SP] - 1
+        ram[sp] = ~ram[sp]
+      elif opcode <= OR:
+        sp = ram[SP] - 1
+        x, y = ram[sp - 1], ram[sp]
+        ram[SP] = sp
+        if opcode == ADD:
+          ram[sp - 1] = wrap(x + y)
+        elif opcode == SUB:
+          ram[sp - 1] = wrap(x - y)
+        elif opcode == EQ:
+          ram[sp - 1] = -(x == y)
+        elif opcode == GT:
+          ram[sp - 1] = -(x > y)
+        elif opcode == LT:
+          ram[sp - 1] = -(x < y)
+        elif opcode == AND:
+          ram[sp - 1] = x & y
+        else:
+          ram[sp - 1] = x | y
+      elif opcode == FUNCTION:
+        sp = ram[SP]
+        for i in range(instruction[1]):
+          ram[sp + i] = 0
+        ram[SP] = sp + instruction[1]
+      elif opcode == CALL:
+        sp = ram[SP]
+        returns.append(pc)
+        ram[sp] = 0
+        ram[sp + 1:sp + 5] = ram[LCL:THAT + 1]
+        ram[ARG] = sp - instruction[2]
+        ram[LCL] = ram[SP] = sp + 5
+        pc = instruction[1]
+      elif opcode == RETURN:
+        frame = ram[LCL]
+        # A frame set up by hand rather than by a call keeps its own return address
+        pc = returns.pop() if returns else ram[frame - 5]
+        arg = ram[ARG]
+        ram[arg] = ram[ram[SP] - 1]
+        ram[SP] = arg + 1
+        ram[LCL:THAT + 1] = ram[frame - 4:frame]
+    self.pc = pc
+    self.steps += steps
+
+  def peek(self, address):
+    return self.ram[address]
+
+  def poke(self, address, value):
+    self.ram[address] = wrap(value)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='VM Interpreter')
+  parser.add_argument('paths', nargs='+', help='.vm files or directories, e.g. a program and tools/OS')
+  parser.add_argument('--steps', type=int, default=1000000, help='number of VM commands to execute')
+  parser.add_argument('--set', nargs='*', default=[], metavar='ADDRESS=VALUE', help='initial RAM values')
+  parser.add_argument('--dump', nargs='*', type=int, default=[], metavar='ADDRESS', help='RAM addresses to print after the run')
+  args = parser.parse_args()
+  interpreter = Interpreter(args.paths)
+  for assignment in args.set:
+    address, value = assignment.split('=')
+    interpreter.poke(int(address), int(value))
+  interpreter.run(args.steps)
+  for address in args.dump:
+    print(f'RAM[{address}] = {interpreter.peek(address)}')
@@ -0,0 +1,53 @@
+# Matches any A-instruction other than @SP
+ANY = '@*'
+
+class PeepholeOptimizer:
+  def __init__(self):
+    self.rules = [
+      # SP incremented and immediately decremented again
+      (['@SP', 'M=M+1', '@SP', 'M=M-1'], []),
+      (['@SP', 'M=M+1', '@SP', 'AM=M-1'], ['@SP', 'A=M']),
+      (['@SP', 'M=M+1', ANY, 'D=A', '@SP', 'AM=M-1'], [ANY, 'D=A', '@SP', 'A=M']),
+      # Popping the value just pushed: D still holds it
+      (['@SP', 'A=M', 'M=D', '@SP', 'A=M', 'D=M'], ['@SP', 'A=M', 'M=D']),
+      (['@SP', 'M=M-1', '@SP', 'A=M'], ['@SP', 'AM=M-1']),
+      # Stores above the stack pointer are never read back
+      (['@SP', 'A=M', 'M=D', ANY, 'M=D'], [ANY, 'M=D']),
+      (['@SP', 'A=M', 'M=D', '@SP', 'AM=M-1'], ['@SP', 'AM=M-1']),
+    ]
+
+  def match(self, window, pattern):
+    wildcard = ''
+    for instruction, expected in zip(window, pattern):
+      if expected == ANY:
+        if not instruction.startswith('@') or instruction == '@SP':
+          return None
+        wildcard = instruction
+      elif instruction != expected:
+        return None
+    return wildcard
+
+  def reduce(self, result):
+    while True:
+      if len(result) > 1 and result[-1].startswith('@') and result[-2].startswith('@'):
+        # The first load is dead
+        del result[-2]
+        continue
+      for pattern, replacement in self.rules:
+        if len(result) < len(pattern):
+          continue
+        wildcard = self.match(result[-len(pattern):], pattern)
+        if wildcard is not None:
+          result[-len(pattern):] = [wildcard if x == ANY else x for x in replacement]
+          break
+      else:
+        return
+
+  def optimize(self, instructions):
+    result = []
+    for instruction in instructions:
+      if instruction.startswith('//'):
+        continue
+      result.append(instruction)
+      self.reduce(result)
+    return result
@@ -0,0 +1,67 @@
+import pytest
+
+from translator.optimizer import PeepholeOptimizer
+
+# The rules on the smallest windows that match them. Whole programs are
+# checked with and without --optimize by test_translator.py
+RULES = {
+  'cancel-increment': (
+    ['@SP', 'M=M+1', '@SP', 'M=M-1'],
+    [],
+  ),
+  'cancel-increment-pop': (
+    ['@SP', 'M=M+1', '@SP', 'AM=M-1'],
+    ['@SP', 'A=M'],
+  ),
+  'cancel-increment-around-constant': (
+    ['@SP', 'M=M+1', '@7', 'D=A', '@SP', 'AM=M-1'],
+    ['@7', 'D=A', '@SP', 'A=M'],
+  ),
+  'fold-pop-after-push': (
+    ['@SP', 'A=M', 'M=D', '@SP', 'A=M', 'D=M'],
+    ['@SP', 'A=M', 'M=D'],
+  ),
+  'fold-decrement-load': (
+    ['@SP', 'M=M-1', '@SP', 'A=M'],
+    ['@SP', 'AM=M-1'],
+  ),
+  'dead-load': (
+    ['@5', '@LCL', 'D=M'],
+    ['@LCL', 'D=M'],
+  ),
+  'store-above-sp-then-store': (
+    ['@SP', 'A=M', 'M=D', '@R13', 'M=D'],
+    ['@R13', 'M=D'],
+  ),
+  'store-above-sp-then-pop': (
+    ['@SP', 'A=M', 'M=D', '@SP', 'AM=M-1'],
+    ['@SP', 'AM=M-1'],
+  ),
+  'cascade': (
+    ['@SP', 'A=M', 'M=D', '@SP', 'M=M+1', '@SP', 'M=M-1', '@SP', 'A=M', 'D=M'],
+    ['@SP', 'A=M', 'M=D'],
+  ),
+  'comments-dropped': (
+    ['// push constant 1', '@SP', 'M=M+1', '// pop', '@SP', 'M=M-1'],
+    [],
+  ),
+}
+
+# Windows that look like a rule but must be left alone
+KEPT = {
+  'label-between-increments': ['@SP', 'M=M+1', '(LOOP)', '@SP', 'M=M-1'],
+  'label-between-loads': ['@5', '(LOOP)', '@6', 'D=A'],
+  'label-after-push': ['@SP', 'A=M', 'M=D', '(LOOP)', '@SP', 'A=M', 'D=M'],
+  'label-after-store': ['@SP', 'A=M', 'M=D', '(LOOP)', '@R13', 'M=D'],
+  'store-to-sp': ['@SP', 'A=M', 'M=D', '@SP', 'M=D'],
+  'jump-after-store': ['@SP', 'A=M', 'M=D', '@END', 'D;JGT'],
+  'wildcard-is-not-sp': ['@SP', 'M=M+1', '@SP', 'D=A', '@SP', 'AM=M-1'],
+}
+
+@pytest.mark.parametrize('instructions, expected', RULES.values(), ids=RULES.keys())
+def test_rule(instructions, expected):
+  assert PeepholeOptimizer().optimize(instructions) == expected
+
+@pytest.mark.parametrize('instructions', KEPT.values(), ids=KEPT.keys())
+def test_kept(instructions):
+  assert PeepholeOptimizer().optimize(instructions) == instructions
@@ -0,0 +1,71 @@
+import glob
+import itertools
+import os
+import re
+import shutil
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECTS = os.path.dirname(os.path.dirname(HERE))
+# The translator's modules import each other by bare name. This file is
+# collected as part of the translator package, so translator.py is
+# imported through it
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(PROJECTS, '06'))
+
+from assembler import Assembler, load_rom
+from emulator import CPU
+from translator.translator import Translator
+
+# The CPU emulator scripts; the VME ones are for the VM emulator
+TESTS = sorted(
+  tst for tst in glob.glob(os.path.join(PROJECTS, '0[78]', '*', '*', '*.tst'))
+  if not tst.endswith('VME.tst')
+)
+FLAGS = ('optimize', 'shared_calls', 'stack_caching', 'prune', 'jobs')
+COMBINATIONS = list(itertools.product([False, True], repeat=len(FLAGS)))
+
+def name(tst):
+  return os.path.basename(tst).replace('.tst', '')
+
+def flags(combination):
+  return '-'.join(flag for flag, on in zip(FLAGS, combination) if on) or 'default'
+
+def translate(directory, optimize=False, shared_calls=False, stack_caching=False, prune=False, jobs=False):
+  # Programs with a Sys.vm are translated as a directory, with bootstrap
+  # code; the others are a single file
+  if os.path.exists(os.path.join(directory, 'Sys.vm')):
+    target = directory
+  else:
+    target = os.path.join(directory, directory + '.vm')
+  Translator(target, optimize, shared_calls, 2 if jobs else 1, None, stack_caching, prune).translate()
+  asm = os.path.join(directory, directory + '.asm')
+  Assembler().parse(asm)
+  return asm.replace('.asm', '.hack')
+
+def run_script(tst, hack):
+  # Follows the script's set and repeat commands, and returns the
+  # output-list cells next to the expected ones from the .cmp file
+  with open(tst) as f:
+    script = re.sub(r'//.*', '', f.read())
+  cpu = CPU(load_rom(hack))
+  for address, value in re.findall(r'set\s+RAM\[(\d+)\]\s+(-?\d+)', script):
+    cpu.poke(int(address), int(value))
+  cpu.run(int(re.search(r'repeat\s+(\d+)', script).group(1)))
+  with open(tst.replace('.tst', '.cmp')) as f:
+    header, expected = f.read().splitlines()[:2]
+  cells = [cell.strip() for cell in header.strip().strip('|').split('|')]
+  got = [str(cpu.peek(int(re.search(r'\d+', cell).group()))) for cell in cells]
+  return got, [value.strip() for value in expected.strip().strip('|').split('|')]
+
+@pytest.mark.parametrize('combination', COMBINATIONS, ids=flags)
+@pytest.mark.parametrize('tst', TESTS, ids=name)
+def test_program(tst, combination, tmp_path, monkeypatch):
+  directory = os.path.basename(os.path.dirname(tst))
+  shutil.copytree(os.path.dirname(tst), tmp_path / directory)
+  monkeypatch.chdir(tmp_path)
+  hack = translate(directory, *combination)
+  got, expected = run_script(tst, hack)
+  assert got == expected
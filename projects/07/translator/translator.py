@@ -1,19 +1,34 @@
 import argparse
+import hashlib
+import io
+import json
 import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from enum import IntEnum
+from functools import lru_cache
 
 from builder import CodeBuilder
+from optimizer import PeepholeOptimizer
+
+# Bump whenever generated code changes, so cached translations are not reused
+VERSION = 3
+# Rendered push, pop and arithmetic commands kept per writer
+RENDER_CACHE_SIZE = 1024
 
 # OP CODES
-C_ARITHMETIC = 'C_ARITHMETIC'
-C_PUSH = 'C_PUSH'
-C_POP = 'C_POP'
-C_LABEL = 'C_LABEL'
-C_GOTO = 'C_GOTO'
-C_IF = 'C_IF'
-C_FUNCTION = 'C_FUNCTION'
-C_CALL = 'C_CALL'
-C_RETURN = 'C_RETURN'
+class CommandType(IntEnum):
+  C_ARITHMETIC = 0
+  C_PUSH = 1
+  C_POP = 2
+  C_LABEL = 3
+  C_GOTO = 4
+  C_IF = 5
+  C_FUNCTION = 6
+  C_CALL = 7
+  C_RETURN = 8
+
+C_ARITHMETIC, C_PUSH, C_POP, C_LABEL, C_GOTO, C_IF, C_FUNCTION, C_CALL, C_RETURN = CommandType
 
 class Reader:
   def __init__(self, filename):
@@ -32,11 +47,24 @@ class Reader:
   def readlines(self):
     return list(self.read())
 
+class VMCommand:
+  __slots__ = ('type', 'arg1', 'arg2', 'line')
+
+  def __init__(self, type, arg1, arg2, line):
+    self.type = type
+    self.arg1 = arg1
+    self.arg2 = arg2
+    self.line = line
+
+  @property
+  def comment(self):
+    return f'// {self.line}'
+
 class Parser:
+  # Yields each command of the file once, split and classified, without
+  # reading the whole file into memory
   def __init__(self, filename):
-    self.line_number = 0
     self.reader = Reader(filename)
-    self.lines = self.reader.readlines()
     self.symbols = defaultdict(lambda: C_ARITHMETIC, {
       'push': C_PUSH,
       'pop': C_POP,
@@ -48,36 +76,38 @@ class Parser:
       'return': C_RETURN,
     })
 
-  def hasMoreLines(self):
-    return self.line_number < len(self.lines)
-
-  def advance(self):
-    self.line_number += 1
-
-  @property
-  def comment(self):
-    return f'// {self.lines[self.line_number-1]}'
-
-  @property
-  def current_line(self):
-    return self.lines[self.line_number-1].split(' ')
-
-  def commandType(self):
-    return self.symbols[self.current_line[0]]
-
-  def arg1(self):
-    if len(self.current_line) == 1:
-      return self.current_line[0]
-    return self.current_line[1]
-
-  def arg2(self):
-    return self.current_line[2]
+  def __iter__(self):
+    for line in self.reader.read():
+      words = line.split(' ')
+      arg1 = words[0] if len(words) == 1 else words[1]
+      arg2 = words[2] if len(words) > 2 else None
+      yield VMCommand(self.symbols[words[0]], arg1, arg2, line)
 
 class CodeWriter:
-  def __init__(self, filename):
-    self.filename = filename
-    self.f = open(self.filename + '.asm', 'w')
+  def __init__(self, f, optimize=False, shared_calls=False):
+    self.filename = ''
+    self.function = ''
+    self.f = f
     self.builder = CodeBuilder()
+    self.shared_calls = shared_calls
+    self.uses_trampolines = False
+    # Instructions are held until the next flush, which optimizes them as
+    # one chunk: each translated file, and the rest of the program at close
+    self.optimizer = PeepholeOptimizer() if optimize else None
+    self.instructions = []
+    self.templates = {}
+    self.handlers = {
+      C_ARITHMETIC: lambda command: self.writeArithmetic(command.arg1),
+      C_PUSH: lambda command: self.writePush(command.arg1, command.arg2),
+      C_POP: lambda command: self.writePop(command.arg1, command.arg2),
+      C_LABEL: lambda command: self.writeLabel(command.arg1),
+      C_GOTO: lambda command: self.writeGoto(command.arg1),
+      C_IF: lambda command: self.writeIf(command.arg1),
+      C_FUNCTION: lambda command: self.writeFunction(command.arg1, command.arg2),
+      C_CALL: lambda command: self.writeCall(command.arg1, command.arg2),
+      C_RETURN: lambda command: self.writeReturn(),
+    }
+    self.render = lru_cache(maxsize=RENDER_CACHE_SIZE)(self.render)
     self.locations = {
       'local': 'LCL',
       'argument': 'ARG',
@@ -101,118 +131,326 @@ class CodeWriter:
     return index
 
   def write(self, commands):
-    self.f.write('\n'.join(commands))
-    self.f.write('\n')
-
-  def writePushPop(self, command, segment, index):
-    if command == C_PUSH:
-      self.writePush(segment, index)
-    else:
-      self.writePop(segment, index)
-
-  def push(self, segment, index):
-    address = self.getMemory(segment, index)
+    self.writeText('\n'.join(commands) + '\n')
+
+  def writeText(self, text):
+    if self.optimizer:
+      self.instructions += text.splitlines()
+      return
+    self.f.write(text)
+
+  def writeChunk(self, text):
+    self.flush()
+    self.f.write(text)
+
+  def flush(self):
+    if self.optimizer and self.instructions:
+      self.f.write('\n'.join(self.optimizer.optimize(self.instructions)))
+      self.f.write('\n')
+      self.instructions = []
+
+  def template(self, key, build, *placeholders):
+    # Most commands expand to the same instructions whatever their arguments,
+    # so each shape is built once with placeholders and then only formatted
+    template = self.templates.get(key)
+    if template is None:
+      template = self.templates[key] = '\n'.join(build(*placeholders)) + '\n'
+    return template
+
+  def push(self, segment, address, index):
     if segment == 'constant':
       return self.builder.push_constant(address)
-    elif segment == 'temp' or segment == 'pointer':
+    elif segment in ('temp', 'pointer', 'static'):
       return self.builder.push_memory(address)
     return self.builder.push_memory(address, index)
 
+  def render(self, command, segment, index, filename):
+    # The file name is part of the key because static addresses depend on it
+    if command == C_ARITHMETIC:
+      return self.template((C_ARITHMETIC, segment), self.builder.arithmetic, segment)
+    # A zero index takes a shorter path through the builder
+    offset = '0' if index == '0' else '{1}'
+    build = self.push if command == C_PUSH else self.pop
+    template = self.template((command, segment, offset), build, segment, '{0}', offset)
+    return template.format(self.getMemory(segment, index), index)
+
+  def cache_info(self):
+    return self.render.cache_info()
+
   def writePush(self, segment, index):
-    result = self.push(segment, index)
-    self.write(result)
+    self.writeText(self.render(C_PUSH, segment, index, self.filename))
 
-  def pop(self, segment, index):
-    address = self.getMemory(segment, index)
-    if segment == 'temp' or segment == 'pointer':
+  def pop(self, segment, address, index):
+    if segment in ('temp', 'pointer', 'static'):
       return self.builder.pop_memory(address)
     return self.builder.pop_to_address(address, index)
 
   def writePop(self, segment, index):
-    result = self.pop(segment, index)
-    self.write(result)
+    self.writeText(self.render(C_POP, segment, index, self.filename))
 
   def writeArithmetic(self, command):
-    result = self.builder.arithmetic(command)
-    self.write(result)
+    if command in self.builder.jumps:
+      # Comparisons generate a fresh label every time
+      self.write(self.builder.arithmetic(command))
+      return
+    self.writeText(self.render(C_ARITHMETIC, command, None, self.filename))
 
   def setFileName(self, filename):
     self.filename = filename
+    self.builder = CodeBuilder(os.path.basename(filename).replace('.vm', ''))
+
+  def scope(self, label):
+    # VM labels are only unique within their function
+    return f'{self.function}${label}'
 
   def writeLabel(self, label):
-    result = self.builder.create_label(label)
-    self.write(result)
+    self.writeText(self.template(C_LABEL, self.builder.create_label, '{0}').format(self.scope(label)))
 
   def writeGoto(self, label):
-    result = self.builder.goto(label)
-    self.write(result)
+    self.writeText(self.template(C_GOTO, self.builder.goto, '{0}').format(self.scope(label)))
 
   def writeIf(self, label):
-    result = self.builder.if_goto(label)
-    self.write(result)
+    self.writeText(self.template(C_IF, self.builder.if_goto, '{0}').format(self.scope(label)))
 
   def writeFunction(self, functionName, nVars):
-    result = self.builder.function(functionName, nVars)
-    self.write(result)
+    self.function = functionName
+    template = self.template((C_FUNCTION, nVars), self.builder.function, '{0}', nVars)
+    self.writeText(template.format(functionName))
 
   def writeCall(self, functionName, nArgs):
-    result = self.builder.call(functionName, nArgs)
+    if self.shared_calls:
+      result = self.builder.call_shared(functionName, nArgs)
+      self.uses_trampolines = True
+    else:
+      result = self.builder.call(functionName, nArgs)
     self.write(result)
 
   def writeReturn(self):
-    result = self.builder.build_return()
-    self.write(result)
+    if self.shared_calls:
+      self.uses_trampolines = True
+      self.writeText(self.template((C_RETURN, True), self.builder.return_shared))
+    else:
+      self.writeText(self.template((C_RETURN, False), self.builder.build_return))
 
   def close(self):
     self.write(self.builder.end())
+    if self.uses_trampolines:
+      self.write(self.builder.trampolines())
+    self.flush()
     self.f.close()
 
+class StackCachingWriter(CodeWriter):
+  # Keeps the top of the stack in D through straight-line code, and only
+  # writes it back where control flow can join or leave: labels, jumps,
+  # calls and returns
+  def __init__(self, f, optimize=False, shared_calls=False):
+    super().__init__(f, optimize, shared_calls)
+    self.cached = False
+
+  def spill(self):
+    if self.cached:
+      self.write(self.builder.spill())
+      self.cached = False
+
+  def load(self):
+    if not self.cached:
+      self.write(self.builder.load_top())
+      self.cached = True
+
+  def flush(self):
+    self.spill()
+    super().flush()
+
+  def writePush(self, segment, index):
+    self.spill()
+    address = self.getMemory(segment, index)
+    if segment == 'constant':
+      self.write(self.builder.load_constant(address))
+    elif segment in self.locations:
+      self.write(self.builder.load_memory(address, index))
+    else:
+      self.write(self.builder.load_memory(address))
+    self.cached = True
+
+  def writePop(self, segment, index):
+    self.load()
+    address = self.getMemory(segment, index)
+    if segment in self.locations:
+      self.write(self.builder.store_to_address(address, index))
+    else:
+      self.write(self.builder.store_memory(address))
+    self.cached = False
+
+  def writeArithmetic(self, command):
+    self.load()
+    self.write(self.builder.arithmetic_top(command))
+
+  def writeLabel(self, label):
+    self.spill()
+    super().writeLabel(label)
+
+  def writeGoto(self, label):
+    self.spill()
+    super().writeGoto(label)
+
+  def writeIf(self, label):
+    self.load()
+    self.write(self.builder.if_goto_top(self.scope(label)))
+    self.cached = False
+
+  def writeFunction(self, functionName, nVars):
+    self.spill()
+    super().writeFunction(functionName, nVars)
+
+  def writeCall(self, functionName, nArgs):
+    self.spill()
+    super().writeCall(functionName, nArgs)
+
+  def writeReturn(self):
+    self.spill()
+    super().writeReturn()
+
+def translate_file(filename, optimize=False, shared_calls=False, stack_caching=False, skip=frozenset()):
+  # Translates one .vm file on its own; labels are namespaced by file name
+  writer = (StackCachingWriter if stack_caching else CodeWriter)(io.StringIO(), optimize, shared_calls)
+  writer.setFileName(filename)
+  live = True
+  for command in Parser(filename):
+    if command.type == C_FUNCTION:
+      live = command.arg1 not in skip
+    if not live:
+      continue
+    writer.writeText(command.comment + '\n') # TODO: move to same line
+    writer.handlers[command.type](command)
+  writer.flush()
+  return writer.f.getvalue(), writer.uses_trampolines
+
+def call_graph(files):
+  # Functions defined in each file, and the functions each one calls
+  functions = {}
+  calls = {}
+  for filename in files:
+    functions[filename] = []
+    function = None
+    for command in Parser(filename):
+      if command.type == C_FUNCTION:
+        function = command.arg1
+        functions[filename].append(function)
+        calls[function] = set()
+      elif command.type == C_CALL and function is not None:
+        # Calls outside any function never run
+        calls[function].add(command.arg1)
+  return functions, calls
+
+def reachable(calls, root='Sys.init'):
+  seen = set([root])
+  pending = [root]
+  while pending:
+    for callee in calls.get(pending.pop(), ()):
+      if callee not in seen:
+        seen.add(callee)
+        pending.append(callee)
+  return seen
+
+class TranslationCache:
+  # Translated chunks on disk, keyed by file content and everything else
+  # the translation depends on
+  def __init__(self, directory, *options):
+    self.directory = directory
+    self.options = options
+    os.makedirs(directory, exist_ok=True)
+
+  def path(self, filename, skip):
+    with open(filename, 'rb') as f:
+      digest = hashlib.sha256(f.read())
+    # Static symbols are named after the file path
+    digest.update(repr((VERSION, filename, self.options, sorted(skip))).encode())
+    return os.path.join(self.directory, f'{digest.hexdigest()}.json')
+
+  def load(self, path):
+    if not os.path.exists(path):
+      return None
+    with open(path, 'r') as f:
+      chunk = json.load(f)
+    return chunk['asm'], chunk['trampolines']
+
+  def store(self, path, chunk):
+    with open(path + '.tmp', 'w') as f:
+      json.dump({'asm': chunk[0], 'trampolines': chunk[1]}, f)
+    os.replace(path + '.tmp', path)
+
 class Translator:
-  def __init__(self, filename: str):
+  def __init__(self, filename: str, optimize=False, shared_calls=False, jobs=1, cache=None, stack_caching=False, prune=False):
     self.filename = filename
+    self.prune = prune
+    self.removed = []
+    self.optimize = optimize
+    self.shared_calls = shared_calls
+    self.stack_caching = stack_caching
+    self.jobs = jobs
+    self.cache = TranslationCache(cache, optimize, shared_calls, stack_caching) if cache else None
 
   def translate(self):
     if self.filename.endswith('vm'):
-      self.writer = CodeWriter(self.filename.replace('.vm', ''))
-      self._translate(self.filename)
+      outfile = self.filename.replace('.vm', '')
+      files = [self.filename]
     else:
       filename = self.filename.split('\\')[-1]
-      self.writer = CodeWriter(os.path.join(self.filename, filename))
+      outfile = os.path.join(self.filename, filename)
+      files = sorted(os.path.join(self.filename, f) for f in os.listdir(self.filename) if f.endswith('.vm'))
+    skips = [frozenset()] * len(files)
+    if self.prune and not self.filename.endswith('vm'):
+      skips = self.unreachable(files)
+    chunks = self.translate_files(files, skips)
+    self.writer = CodeWriter(open(outfile + '.asm', 'w'), self.optimize, self.shared_calls)
+    if not self.filename.endswith('vm'):
       self.writer.bootstrap()
-      files = [f for f in os.listdir(self.filename) if f.endswith('.vm')]
-      for file in files:
-        filename = os.path.join(self.filename, file)
-        self._translate(filename)
+    for text, uses_trampolines in chunks:
+      self.writer.writeChunk(text)
+      self.writer.uses_trampolines |= uses_trampolines
     self.writer.close()
 
-  def _translate(self, filename: str):
-    self.parser = Parser(filename)
-    self.writer.setFileName(filename)
-    while self.parser.hasMoreLines():
-      self.parser.advance()
-      self.writer.write([self.parser.comment]) # TODO: move to same line
-      if self.parser.commandType() == C_ARITHMETIC:
-        self.writer.writeArithmetic(self.parser.arg1())
-      elif self.parser.commandType() == C_PUSH:
-        self.writer.writePushPop(C_PUSH, self.parser.arg1(), self.parser.arg2())
-      elif self.parser.commandType() == C_POP:
-        self.writer.writePushPop(C_POP, self.parser.arg1(), self.parser.arg2())
-      elif self.parser.commandType() == C_LABEL:
-        self.writer.writeLabel(self.parser.arg1())
-      elif self.parser.commandType() == C_GOTO:
-        self.writer.writeGoto(self.parser.arg1())
-      elif self.parser.commandType() == C_IF:
-        self.writer.writeIf(self.parser.arg1())
-      elif self.parser.commandType() == C_FUNCTION:
-        self.writer.writeFunction(self.parser.arg1(), self.parser.arg2())
-      elif self.parser.commandType() == C_CALL:
-        self.writer.writeCall(self.parser.arg1(), self.parser.arg2())
-      elif self.parser.commandType() == C_RETURN:
-        self.writer.writeReturn()
+  def unreachable(self, files):
+    # Functions never called on any path from Sys.init, per file
+    functions, calls = call_graph(files)
+    if 'Sys.init' not in calls:
+      return [frozenset()] * len(files)
+    live = reachable(calls)
+    self.removed = sorted(set(calls) - live)
+    return [frozenset(functions[f]) - live for f in files]
+
+  def translate_files(self, files, skips):
+    if not self.cache:
+      return self.translate_all(files, skips)
+    paths = [self.cache.path(f, skip) for f, skip in zip(files, skips)]
+    chunks = [self.cache.load(path) for path in paths]
+    missing = [i for i, chunk in enumerate(chunks) if chunk is None]
+    for i, chunk in zip(missing, self.translate_all([files[i] for i in missing], [skips[i] for i in missing])):
+      self.cache.store(paths[i], chunk)
+      chunks[i] = chunk
+    return chunks
+
+  def translate_all(self, files, skips):
+    if not files:
+      return []
+    options = [[option] * len(files) for option in (self.optimize, self.shared_calls, self.stack_caching)]
+    if self.jobs == 1 or len(files) == 1:
+      return list(map(translate_file, files, *options, skips))
+    # Each file is independent, and map keeps the results in file order
+    with ProcessPoolExecutor(self.jobs) as executor:
+      return list(executor.map(translate_file, files, *options, skips))
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Translator')
   parser.add_argument('filename', help='input file')
+  parser.add_argument('--optimize', action='store_true', help='run peephole optimizations over the generated assembly')
+  parser.add_argument('--shared-calls', action='store_true', help='route call and return through one shared routine each')
+  parser.add_argument('--jobs', type=int, default=1, help='translate the files of a directory in this many processes')
+  parser.add_argument('--cache', metavar='DIRECTORY', help='reuse translations of unchanged files from this directory')
+  parser.add_argument('--stack-caching', action='store_true', help='keep the top of the stack in D between VM commands')
+  parser.add_argument('--prune', action='store_true', help='leave out functions that cannot be reached from Sys.init')
   args = parser.parse_args()
-  translator = Translator(args.filename)
-  translator.translate()
\ No newline at end of file
+  translator = Translator(args.filename, args.optimize, args.shared_calls, args.jobs, args.cache, args.stack_caching, args.prune)
+  translator.translate()
+  if translator.removed:
+    print(f'Removed {len(translator.removed)} unreachable functions: {", ".join(translator.removed)}')
\ No newline at end of file
@@ -1,6 +1,11 @@
 import argparse
-from dicttoxml import dicttoxml
-from xml.dom.minidom import parseString
+import re
+import sys
+
+from nodes import (
+  Class, ClassVarDec, Subroutine, Parameter, VarDec, Let, If, While, Do, Return,
+  BinaryOp, UnaryOp, Group, IntegerConstant, StringConstant, KeywordConstant, Variable, ArrayAccess, Call, Visitor
+)
 
 keywords = set([
   'class', 'constructor', 'function', 'method', 'field', 'static', 'var', 'int', 'char', 'boolean', 'void', 'true', 'false', 'null', 'this', 'let', 'do', 'if', 'else', 'while', 'return'
@@ -9,63 +14,91 @@ symbols = set([
   '{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', '<', '>', '=', '~'
 ])
 
+# Each match is one token, a newline or a comment, after any leading blanks;
+# a lone character that matches nothing else is an error
+token_pattern = re.compile(r'''[ \t\r\f\v]*(?:
+  (\n)
+  |(//[^\n]*|/\*.*?\*/)
+  |([{}()\[\].,;+\-*/&|<>=~])
+  |(\d+)
+  |("[^"\n]*)"
+  |([A-Za-z_]\w*)
+  |(.)
+)''', re.VERBOSE | re.DOTALL)
+NEWLINE, COMMENT, SYMBOL, INTEGER, STRING, WORD, ERROR = range(1, 8)
+
+# Characters that must be escaped in the XML text
+escapes = str.maketrans({'<': '&lt;', '>': '&gt;', '&': '&amp;', '"': '&quot;'})
+
 class JackTokenizer:
   def __init__(self, filename):
     with open(filename, 'r') as f:
       self.text = f.read()
+    self.tokens = []
     self.counter = 0
+    self.type = ''
     self.token = ''
 
-  def removeComments(self):
-    single_lines = self.text.split('//')
-    single_lines_removed = ''.join([
-      line.split('\n', 1)[-1] for line in single_lines
-    ])
-    all_comments = single_lines_removed.split('/**')
-    self.text = ''.join([
-      line.split('*/', 1)[-1] for line in all_comments
-    ])
+  def tokenize(self):
+    # Lexes the whole text once into (type, value, line, column) tuples,
+    # skipping comments. String constants keep their opening quote, so they
+    # never compare equal to a symbol or keyword
+    tokens = []
+    line, start = 1, 0
+    for match in token_pattern.finditer(self.text):
+      group = match.lastindex
+      if group == NEWLINE:
+        line += 1
+        start = match.end()
+        continue
+      value = match.group(group)
+      if group == COMMENT:
+        if '\n' in value:
+          line += value.count('\n')
+          start = match.start(group) + value.rindex('\n') + 1
+        continue
+      if group == SYMBOL:
+        kind = 'symbol'
+      elif group == WORD:
+        kind = 'keyword' if value in keywords else 'identifier'
+        # Every use of a name is then the same object, which makes the
+        # compiler's symbol lookups identity comparisons
+        value = sys.intern(value)
+      elif group == INTEGER:
+        kind = 'integerConstant'
+      elif group == STRING:
+        kind = 'stringConstant'
+      else:
+        raise Exception(f'Unexpected character {value!r} at line {line}, column {match.start(group) - start + 1}')
+      tokens.append((kind, value, line, match.start(group) - start + 1))
+    self.tokens = tokens
+    self.counter = 0
 
   def hasMoreTokens(self):
-    return self.counter < len(self.text) - 1
+    return self.counter < len(self.tokens)
 
-  def peek(self):
-    counter, token = self.counter, self.token
-    self.advance()
-    result = self.token
-    self.counter, self.token = counter, token
-    return result
+  def peek(self, k=1):
+    index = self.counter + k - 1
+    return self.tokens[index][1] if index < len(self.tokens) else ''
 
   def advance(self):
-    current = self.text[self.counter]
+    try:
+      token = self.tokens[self.counter]
+    except IndexError:
+      raise self.unexpected() from None
+    self.type = token[0]
+    self.token = token[1]
     self.counter += 1
-    if current in symbols:
-      self.token = current
-      return
-    if current.isspace():
-      return self.advance()
-    result = current
-    if current == '"':
-      while (current := self.text[self.counter]) != '"':
-        result += current
-        self.counter += 1
-      self.counter += 1
-    else:
-      while (current := self.text[self.counter]) not in symbols and not current.isspace():
-        result += current
-        self.counter += 1
-    self.token = result
+
+  def unexpected(self, what='token'):
+    # An error naming the next token and where it is
+    if self.counter >= len(self.tokens):
+      return Exception('Unexpected end of input')
+    kind, value, line, column = self.tokens[self.counter]
+    return Exception(f'Unexpected {what} {value!r} at line {line}, column {column}')
 
   def tokenType(self):
-    if self.token in symbols:
-      return 'symbol'
-    if self.token in keywords:
-      return 'keyword'
-    if self.token.isdigit():
-      return 'integerConstant'
-    if self.token[0] == '"':
-      return 'stringConstant'
-    return 'identifier'
+    return self.type
 
   def keyWord(self):
     return {'keyword': self.token}
@@ -102,116 +135,68 @@ class CompilationEngine:
   def __init__(self, filename):
     self.tokenizer = JackTokenizer(filename)
     self.outfile = filename.replace('.jack', '_output.xml')
-    self.tokenizer.removeComments()
+    self.tokenizer.tokenize()
+
+  def next(self):
+    self.tokenizer.advance()
+    return self.tokenizer.token
 
   def compileClass(self):
-    declaration = self.tokenizer.next()
-    className = self.tokenizer.next()
-    opening = self.tokenizer.next()
-    result = [
-      declaration,
-      className,
-      opening,
-    ]
+    self.next() # class
+    name = self.next()
+    self.next() # {
+    classVarDecs = []
+    subroutines = []
     while (peek := self.tokenizer.peek()) != '}':
       if peek in ['field', 'static']:
-        result.append(self.compileClassVarDec())
+        classVarDecs.append(self.compileClassVarDec())
       elif peek in ['constructor', 'function', 'method']:
-        result.append(self.compileSubroutine())
+        subroutines.append(self.compileSubroutine())
       else:
-        raise Exception('Unexpected token: ', self.tokenizer.current(), result, peek)
-    result.append(self.tokenizer.current())
-    return {
-      'class': result
-    }
+        raise self.tokenizer.unexpected()
+    return Class(name, classVarDecs, subroutines)
 
   def compileClassVarDec(self):
-    declaration = self.tokenizer.next()
-    type = self.tokenizer.next()
-    name = self.tokenizer.next()
-    symbol = self.tokenizer.next()
-    result = [
-      declaration,
-      type,
-      name,
-      symbol,
-    ]
-    while self.tokenizer.token == ',':
-      name = self.tokenizer.next()
-      symbol = self.tokenizer.next()
-      result += [
-        name,
-        symbol,
-      ]
-    return {
-      'classVarDec': result
-    }
-    
+    kind = self.next()
+    type = self.next()
+    names = [self.next()]
+    while self.next() == ',':
+      names.append(self.next())
+    return ClassVarDec(kind, type, names)
+
   def compileSubroutine(self):
-    declaration = self.tokenizer.next()
-    returnType = self.tokenizer.next()
-    name = self.tokenizer.next()
-    popening = self.tokenizer.next()
+    kind = self.next()
+    returnType = self.next()
+    name = self.next()
+    self.next() # (
     parameters = self.compileParameterList()
-    result = [
-      declaration,
-      returnType,
-      name,
-      popening,
-      *parameters,
-    ]
-    subroutine = [self.tokenizer.next()]
+    self.next() # {
+    varDecs = []
     while self.tokenizer.peek() == 'var':
-      subroutine.append(self.compileVarDec())
+      varDecs.append(self.compileVarDec())
     statements = self.compileStatements()
-    sclosing = self.tokenizer.next()
-    subroutine += [statements, sclosing]
-    result.append({
-      'subroutineBody': subroutine
-    })
-    return {
-      'subroutineDec': result
-    }
+    self.next() # }
+    return Subroutine(kind, returnType, name, parameters, varDecs, statements)
 
   def compileParameterList(self):
+    # Consumes the closing parenthesis
     result = []
     while self.tokenizer.peek() != ')':
-      result.append(self.tokenizer.next())
-      result.append(self.tokenizer.next())
-      symbol = self.tokenizer.next()
-      if self.tokenizer.token != ',':
-        return [
-          {'parameterList': result},
-          symbol
-        ]
-      result.append(symbol)
-    return [
-       {'parameterList': result},
-      self.tokenizer.next()
-    ]
+      type = self.next()
+      result.append(Parameter(type, self.next()))
+      if self.next() != ',':
+        return result
+    self.next() # )
+    return result
 
   def compileVarDec(self):
-    declaration = self.tokenizer.next()
-    type = self.tokenizer.next()
-    name = self.tokenizer.next()
-    symbol = self.tokenizer.next()
-    result = [
-      declaration,
-      type,
-      name,
-      symbol,
-    ]
-    while self.tokenizer.token == ',':
-      name = self.tokenizer.next()
-      symbol = self.tokenizer.next()
-      result += [
-        name,
-        symbol,
-      ]
-    return {
-      'varDec': result
-    }
-    
+    self.next() # var
+    type = self.next()
+    names = [self.next()]
+    while self.next() == ',':
+      names.append(self.next())
+    return VarDec(type, names)
+
   def compileStatements(self):
     result = []
     while (peek := self.tokenizer.peek()) != '}':
@@ -226,204 +211,353 @@ class CompilationEngine:
       elif peek == 'return':
         result.append(self.compileReturn())
       else:
-        raise Exception('Unexpected statement token: ', self.tokenizer.current(), peek)
-    return {
-      'statements': result
-    }
-
-  def compileExpressionListHelper(self):
-    eopen = self.tokenizer.next()
-    expressionList = self.compileExpressionList()
-    eclose = self.tokenizer.next()
-    return [eopen, expressionList, eclose]
-
-  def compileSubroutineCallHelper(self, result):
-    if self.tokenizer.peek() == '.':
-      dot = self.tokenizer.next()
-      call = self.tokenizer.next()
-      result += [dot, call]
-    result += self.compileExpressionListHelper()
-    return result
-
-  def compileSubroutineCall(self):
-    name = self.tokenizer.next()
-    result = [name]
-    self.compileSubroutineCallHelper(result)
+        raise self.tokenizer.unexpected('statement token')
     return result
 
+  def compileSubroutineCall(self, name):
+    receiver = None
+    if self.tokenizer.peek() == '.':
+      self.next() # .
+      receiver, name = name, self.next()
+    self.next() # (
+    arguments = self.compileExpressionList()
+    self.next() # )
+    return Call(receiver, name, arguments)
 
   def compileDo(self):
-    do = self.tokenizer.next()
-    subcall = self.compileSubroutineCall()
-    semi = self.tokenizer.next()
-    return {
-      'doStatement': [
-        do,
-        subcall,
-        semi,
-      ]
-    }
-
+    self.next() # do
+    call = self.compileSubroutineCall(self.next())
+    self.next() # ;
+    return Do(call)
 
   def compileLet(self):
-    let = self.tokenizer.next()
-    name = self.tokenizer.next()
-    result = [let, name]
+    self.next() # let
+    name = self.next()
+    index = None
     if self.tokenizer.peek() == '[':
-      opening = self.tokenizer.next()
-      expression = self.compileExpression()
-      closing = self.tokenizer.next()
-      result += [
-        opening, expression, closing
-      ]
-    equals = self.tokenizer.next()
-    expression = self.compileExpression()
-    semi = self.tokenizer.next()
-    result += [equals, expression, semi]
-    return {
-      'letStatement': result
-    }
-
+      self.next() # [
+      index = self.compileExpression()
+      self.next() # ]
+    self.next() # =
+    value = self.compileExpression()
+    self.next() # ;
+    return Let(name, index, value)
 
   def compileWhile(self):
-    wdeclare = self.tokenizer.next()
-    eopen = self.tokenizer.next()
-    expression = self.compileExpression()
-    eclose = self.tokenizer.next()
-    sopen = self.tokenizer.next()
+    self.next() # while
+    self.next() # (
+    condition = self.compileExpression()
+    self.next() # )
+    self.next() # {
     statements = self.compileStatements()
-    sclose = self.tokenizer.next()
-    return {
-      'whileStatement': [
-        wdeclare,
-        eopen,
-        expression,
-        eclose,
-        sopen,
-        statements,
-        sclose
-      ]
-    }
+    self.next() # }
+    return While(condition, statements)
 
   def compileReturn(self):
-    result = [self.tokenizer.next()]
+    self.next() # return
+    value = None
     if self.tokenizer.peek() != ';':
-      expression = self.compileExpression()
-      result.append(expression)
-    return {
-      'returnStatement': result + [self.tokenizer.next()] # Semi
-    }
-    
+      value = self.compileExpression()
+    self.next() # ;
+    return Return(value)
 
   def compileIf(self):
-    ifdeclare = self.tokenizer.next()
-    ifopen = self.tokenizer.next()
-    ifexpr = self.compileExpression()
-    ifclose = self.tokenizer.next()
-    sopen = self.tokenizer.next()
-    ifstatements = self.compileStatements()
-    sclose = self.tokenizer.next()
-    result = [
-      ifdeclare,
-      ifopen,
-      ifexpr,
-      ifclose,
-      sopen,
-      ifstatements,
-      sclose
-    ]
+    self.next() # if
+    self.next() # (
+    condition = self.compileExpression()
+    self.next() # )
+    self.next() # {
+    statements = self.compileStatements()
+    self.next() # }
+    elseStatements = None
     if self.tokenizer.peek() == 'else':
-      elsedeclare = self.tokenizer.next()
-      elseopen = self.tokenizer.next()
-      elsestatements = self.compileStatements()
-      elseclose = self.tokenizer.next()
-      result += [
-        elsedeclare,
-        elseopen,
-        elsestatements,
-        elseclose
-      ]
-    return {
-      'ifStatement': result
-    }
+      self.next() # else
+      self.next() # {
+      elseStatements = self.compileStatements()
+      self.next() # }
+    return If(condition, statements, elseStatements)
 
   def compileExpression(self):
-    term = self.compileTerm()
-    result = [term]
+    result = self.compileTerm()
     while self.tokenizer.peek() in ['+', '-', '*', '/', '&', '|', '<', '>', '=']:
-      op = self.tokenizer.next()
-      result += [op, self.compileTerm()]
-    return {
-      'expression': result
-    }
+      op = self.next()
+      result = BinaryOp(op, result, self.compileTerm())
+    return result
 
   def compileTerm(self):
-    term = self.tokenizer.next()
-    if self.tokenizer.token == '(': # Expression
-      expression = self.compileExpression()
-      closing = self.tokenizer.next()
-      return {
-        'term': [
-          term,
-          expression,
-          closing
-        ]
-      }
-    elif self.tokenizer.token in ['-', '~']: # Unary operator
-      actualTerm = self.compileTerm()
-      return {
-        'term': [term, actualTerm]
-      }
-    elif self.tokenizer.peek() == '[': 
-      opening = self.tokenizer.next()
+    token = self.next()
+    type = self.tokenizer.tokenType()
+    if token == '(': # Expression
       expression = self.compileExpression()
-      closing = self.tokenizer.next()
-      return {
-        'term': [
-          term,
-          opening,
-          expression,
-          closing
-        ]
-      }
+      self.next() # )
+      return Group(expression)
+    elif token in ['-', '~']: # Unary operator
+      return UnaryOp(token, self.compileTerm())
+    elif self.tokenizer.peek() == '[':
+      self.next() # [
+      index = self.compileExpression()
+      self.next() # ]
+      return ArrayAccess(token, index)
     elif self.tokenizer.peek() in ['(', '.']:
-      subcall = self.compileSubroutineCallHelper([])
-      return {
-        'term': [
-          term,
-          *subcall,
-        ]
-      }
-    return {
-      'term': term
-    }
+      return self.compileSubroutineCall(token)
+    elif type == 'integerConstant':
+      return IntegerConstant(int(token))
+    elif type == 'stringConstant':
+      return StringConstant(token[1:])
+    elif type == 'keyword':
+      return KeywordConstant(token)
+    return Variable(token)
 
   def compileExpressionList(self):
     if self.tokenizer.peek() == ')':
-      return {'expressionList': []}
+      return []
     result = [self.compileExpression()]
     while self.tokenizer.peek() == ',':
-      result += [self.tokenizer.next(), self.compileExpression()]
-    return {
-      'expressionList': result
-    }
+      self.next() # ,
+      result.append(self.compileExpression())
+    return result
+
+class XMLWriter(Visitor):
+  # Streams the parse tree in the format of the nand2tetris compare files.
+  # The file should be opened with newline='\r\n'
+  def __init__(self, f):
+    self.f = f
+    self.indent = ''
+
+  def open(self, tag):
+    self.f.write(f'{self.indent}<{tag}>\n')
+    self.indent += '  '
+
+  def close(self, tag):
+    self.indent = self.indent[:-2]
+    self.f.write(f'{self.indent}</{tag}>\n')
+
+  def write(self, kind, value):
+    self.f.write(f'{self.indent}<{kind}> {str(value).translate(escapes)} </{kind}>\n')
+
+  def token(self, value):
+    if value in symbols:
+      self.write('symbol', value)
+    elif value in keywords:
+      self.write('keyword', value)
+    else:
+      self.write('identifier', value)
+
+  def names(self, names):
+    self.token(names[0])
+    for name in names[1:]:
+      self.token(',')
+      self.token(name)
+    self.token(';')
+
+  def visitClass(self, node):
+    self.open('class')
+    self.token('class')
+    self.token(node.name)
+    self.token('{')
+    for i in node.classVarDecs:
+      self.visit(i)
+    for i in node.subroutines:
+      self.visit(i)
+    self.token('}')
+    self.close('class')
+
+  def visitClassVarDec(self, node):
+    self.open('classVarDec')
+    self.token(node.kind)
+    self.token(node.type)
+    self.names(node.names)
+    self.close('classVarDec')
+
+  def visitSubroutine(self, node):
+    self.open('subroutineDec')
+    self.token(node.kind)
+    self.token(node.returnType)
+    self.token(node.name)
+    self.token('(')
+    self.open('parameterList')
+    for i, parameter in enumerate(node.parameters):
+      if i:
+        self.token(',')
+      self.token(parameter.type)
+      self.token(parameter.name)
+    self.close('parameterList')
+    self.token(')')
+    self.open('subroutineBody')
+    self.token('{')
+    for i in node.varDecs:
+      self.visit(i)
+    self.statements(node.statements)
+    self.token('}')
+    self.close('subroutineBody')
+    self.close('subroutineDec')
+
+  def visitVarDec(self, node):
+    self.open('varDec')
+    self.token('var')
+    self.token(node.type)
+    self.names(node.names)
+    self.close('varDec')
+
+  def statements(self, statements):
+    self.open('statements')
+    for i in statements:
+      self.visit(i)
+    self.close('statements')
+
+  def visitLet(self, node):
+    self.open('letStatement')
+    self.token('let')
+    self.token(node.name)
+    if node.index is not None:
+      self.token('[')
+      self.expression(node.index)
+      self.token(']')
+    self.token('=')
+    self.expression(node.value)
+    self.token(';')
+    self.close('letStatement')
+
+  def visitIf(self, node):
+    self.open('ifStatement')
+    self.token('if')
+    self.token('(')
+    self.expression(node.condition)
+    self.token(')')
+    self.token('{')
+    self.statements(node.statements)
+    self.token('}')
+    if node.elseStatements is not None:
+      self.token('else')
+      self.token('{')
+      self.statements(node.elseStatements)
+      self.token('}')
+    self.close('ifStatement')
+
+  def visitWhile(self, node):
+    self.open('whileStatement')
+    self.token('while')
+    self.token('(')
+    self.expression(node.condition)
+    self.token(')')
+    self.token('{')
+    self.statements(node.statements)
+    self.token('}')
+    self.close('whileStatement')
+
+  def visitDo(self, node):
+    self.open('doStatement')
+    self.token('do')
+    self.call(node.call)
+    self.token(';')
+    self.close('doStatement')
+
+  def visitReturn(self, node):
+    self.open('returnStatement')
+    self.token('return')
+    if node.value is not None:
+      self.expression(node.value)
+    self.token(';')
+    self.close('returnStatement')
+
+  def expression(self, node):
+    self.open('expression')
+    self.operand(node)
+    self.close('expression')
+
+  def operand(self, node):
+    # Flattens a left-nested chain of operators back into term op term ...
+    if isinstance(node, BinaryOp):
+      self.operand(node.left)
+      self.token(node.op)
+      self.visit(node.right)
+    else:
+      self.visit(node)
+
+  def call(self, node):
+    if node.receiver is not None:
+      self.token(node.receiver)
+      self.token('.')
+    self.token(node.name)
+    self.token('(')
+    self.open('expressionList')
+    for i, argument in enumerate(node.arguments):
+      if i:
+        self.token(',')
+      self.expression(argument)
+    self.close('expressionList')
+    self.token(')')
+
+  def visitGroup(self, node):
+    self.open('term')
+    self.token('(')
+    self.expression(node.expression)
+    self.token(')')
+    self.close('term')
+
+  def visitUnaryOp(self, node):
+    self.open('term')
+    self.token(node.op)
+    self.visit(node.operand)
+    self.close('term')
+
+  def visitIntegerConstant(self, node):
+    self.open('term')
+    self.write('integerConstant', node.value)
+    self.close('term')
+
+  def visitStringConstant(self, node):
+    self.open('term')
+    self.write('stringConstant', node.value)
+    self.close('term')
+
+  def visitKeywordConstant(self, node):
+    self.open('term')
+    self.write('keyword', node.value)
+    self.close('term')
+
+  def visitVariable(self, node):
+    self.open('term')
+    self.write('identifier', node.name)
+    self.close('term')
+
+  def visitArrayAccess(self, node):
+    self.open('term')
+    self.write('identifier', node.name)
+    self.token('[')
+    self.expression(node.index)
+    self.token(']')
+    self.close('term')
+
+  def visitCall(self, node):
+    self.open('term')
+    self.call(node)
+    self.close('term')
 
 class JackAnalyzer:
   def __init__(self, filename: str):
     self.engine = CompilationEngine(filename)
+    self.tokensfile = filename.replace('.jack', 'T_output.xml')
 
   def analyze(self):
     result = self.engine.compileClass()
-    xml = dicttoxml(result, attr_type = False, root=False)
-    dom = parseString(xml).toprettyxml()
-    formatted = '\n'.join([x.replace('\t', '  ') for x in dom.replace('<item>', '').replace('</item>', '').replace('<item/>', '').split('\n')[1:] if x.strip()])
-    # TODO: replace <emptytag/> with <emptytag></emptytag>
-    with open(self.engine.outfile, 'w') as f:
-      f.write(formatted)
+    with open(self.engine.outfile, 'w', newline='\r\n') as f:
+      XMLWriter(f).visit(result)
+
+  def analyzeTokens(self):
+    with open(self.tokensfile, 'w', newline='\r\n') as f:
+      writer = XMLWriter(f)
+      f.write('<tokens>\n')
+      for kind, value, line, column in self.engine.tokenizer.tokens:
+        writer.write(kind, value[1:] if kind == 'stringConstant' else value)
+      f.write('</tokens>\n')
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Compiler')
   parser.add_argument('filename', help='input file')
+  parser.add_argument('--tokens', action='store_true', help='also write the token stream to <name>T_output.xml')
   args = parser.parse_args()
   analyzer = JackAnalyzer(args.filename)
-  analyzer.analyze()
\ No newline at end of file
+  analyzer.analyze()
+  if args.tokens:
+    analyzer.analyzeTokens()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import argparse
+import glob
+import os
+import re
+import tempfile
+import time
+
+from analyzer import JackTokenizer
+
+PROJECTS = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def jack_files(paths):
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      files += sorted(glob.glob(os.path.join(path, '**', '*.jack'), recursive=True))
+    else:
+      files.append(path)
+  return files
+
+def generate(copies, filename):
+  # One large class: the subroutines of Pong's Ball, renamed per copy
+  with open(os.path.join(PROJECTS, '11', 'Pong', 'Ball.jack')) as f:
+    source = f.read()
+  start = source.index('{') + 1
+  first = re.search(r'\n\s*(constructor|function|method)\b', source).start()
+  subroutines = source[first:source.rindex('}')]
+  out = ['// generated benchmark class', 'class Big {', source[start:first]]
+  for i in range(copies):
+    out.append(re.sub(r'\b(constructor|function|method)(\s+\w+\s+)(\w+)\(', lambda m: f'{m.group(1)}{m.group(2)}{m.group(3)}{i}(', subroutines))
+  out.append('}\n')
+  with open(filename, 'w') as f:
+    f.write('\n'.join(out))
+
+def lex(filename):
+  tokenizer = JackTokenizer(filename)
+  tokenizer.tokenize()
+  return tokenizer
+
+def walk(filename):
+  # Lex, then advance and peek over every token, as the parser does
+  tokenizer = lex(filename)
+  while tokenizer.hasMoreTokens():
+    tokenizer.advance()
+    tokenizer.peek()
+  return len(tokenizer.tokens)
+
+def best(function, files, repeat):
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    for filename in files:
+      function(filename)
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Jack tokenizer benchmark')
+  parser.add_argument('paths', nargs='*', help='.jack files or directories, by default projects/10-12')
+  parser.add_argument('--repeat', type=int, default=7, help='report the best of this many runs')
+  parser.add_argument('--copies', type=int, default=40, help='copies of Ball\'s subroutines in the generated class, 0 for none')
+  args = parser.parse_args()
+  files = jack_files(args.paths or [os.path.join(PROJECTS, str(i)) for i in range(10, 13)])
+  with tempfile.TemporaryDirectory() as directory:
+    if args.copies:
+      files.append(os.path.join(directory, 'Big.jack'))
+      generate(args.copies, files[-1])
+    lines = 0
+    for filename in files:
+      with open(filename) as f:
+        lines += sum(1 for _ in f)
+    tokens = sum(len(lex(filename).tokens) for filename in files)
+    print(f'{len(files)} files, {lines} lines, {tokens} tokens, best of {args.repeat}')
+    for name, function in [('tokenize', lex), ('advance + peek', walk)]:
+      elapsed = best(function, files, args.repeat)
+      print(f'{name}: {elapsed * 1e3:.1f} ms ({tokens / elapsed / 1e6:.2f}M tokens/s)')
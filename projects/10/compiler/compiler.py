@@ -1,38 +1,96 @@
 import argparse
-from collections import Counter, defaultdict
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 from analyzer import CompilationEngine as XMLEngine
+from nodes import Let, If, While, Do, Return, BinaryOp, UnaryOp, Group, IntegerConstant, StringConstant, KeywordConstant, Variable, ArrayAccess, ShiftLeft
+from optimizer import ExpressionOptimizer
+
+# Bump whenever generated code changes, so cached compilations are not reused
+VERSION = 3
+
+class Symbol:
+  __slots__ = ('name', 'type', 'kind', 'index', 'resolved')
+
+  def __init__(self, name, type, kind, index):
+    self.name = name
+    self.type = type
+    self.kind = kind
+    self.index = index
+    # What resolve returns, built once
+    self.resolved = ('this' if kind == 'field' else kind, index, type)
+
+# Stands in for names that are not defined in any scope
+UNKNOWN = Symbol('', '', 'NONE', -1)
 
 class SymbolTable:
-  def __init__(self):
+  # Symbols are kept in a list in definition order, with a dict from each
+  # interned name to its position. Names not defined here are resolved in
+  # the enclosing scope
+  def __init__(self, parent=None):
+    self.parent = parent
+    self.lookups = 0
+    self.misses = 0
     self.reset()
 
   def reset(self):
-    self.table = defaultdict(lambda: ('', 'NONE', -1))
+    self.symbols = []
+    self.positions = {}
     self.indices = Counter()
 
   def define(self, name, type, kind):
-    self.table[name] = (type, kind, self.indices[kind])
+    name = sys.intern(name)
+    symbol = Symbol(name, type, kind, self.indices[kind])
     self.indices[kind] += 1
+    if name in self.positions:
+      self.symbols[self.positions[name]] = symbol
+    else:
+      self.positions[name] = len(self.symbols)
+      self.symbols.append(symbol)
+
+  def lookup(self, name):
+    position = self.positions.get(name)
+    return UNKNOWN if position is None else self.symbols[position]
+
+  def resolve(self, name):
+    # (segment, index, type) from the innermost scope that defines name
+    self.lookups += 1
+    table = self
+    while table is not None:
+      position = table.positions.get(name)
+      if position is not None:
+        return table.symbols[position].resolved
+      table = table.parent
+    self.misses += 1
+    return UNKNOWN.resolved
 
   def varCount(self, kind):
     return self.indices[kind]
 
   def kindOf(self, name):
-    return self.table[name][1]
+    return self.lookup(name).kind
 
   def typeOf(self, name):
-    return self.table[name][0]
+    return self.lookup(name).type
 
   def indexOf(self, name):
-    return self.table[name][2]
+    return self.lookup(name).index
 
   def __repr__(self):
-      return dict(self.table).__repr__()
+      return {s.name: (s.type, s.kind, s.index) for s in self.symbols}.__repr__()
 
 class VMWriter:
+  # Writes to a temporary file that replaces the output on close, so a
+  # failed compile never leaves a truncated .vm behind
   def __init__(self, filename):
-    self.f = open(filename, 'w')
+    self.filename = filename
+    self.f = open(filename + '.tmp', 'w')
     self.arithmetic = {
       '+': 'add',
       '-': 'sub',
@@ -90,225 +148,647 @@ class VMWriter:
 
   def close(self):
     self.f.close()
+    os.replace(self.filename + '.tmp', self.filename)
+
+  def discard(self):
+    self.f.close()
+    os.remove(self.filename + '.tmp')
 
 # Really should not be in python
 class CompilationEngine:
-  def __init__(self, filename):
+  def __init__(self, filename, optimize=False, intern_strings=False):
     self.classSymbols = SymbolTable()
-    self.subSymbols = SymbolTable()
-    self.writer = VMWriter(filename.replace('.jack', '.vm'))
+    self.subSymbols = SymbolTable(self.classSymbols)
+    # Tokenize first, so a source that cannot be read or lexed leaves no
+    # .vm.tmp file behind
     self.analyzer = XMLEngine(filename)
+    self.writer = VMWriter(filename.replace('.jack', '.vm'))
     self.label_counter = 0
+    self.optimize = optimize
+    self.intern_strings = intern_strings
+    # Static index of each interned string literal
+    self.strings = {}
+    self.className = ''
+    self.subroutines = {}
 
   def createLabel(self, name):
     self.label_counter += 1
     return f'{name}_{self.label_counter}'
 
+  def signature(self):
+    # What other classes can see: fields, statics and subroutine arities
+    symbols = self.classSymbols.symbols
+    return {
+      'class': self.className,
+      'fields': [s.name for s in symbols if s.kind == 'field'],
+      'statics': [s.name for s in symbols if s.kind == 'static'],
+      'subroutines': self.subroutines,
+    }
+
+  def compileString(self, string):
+    if self.intern_strings:
+      # Built on first use and kept in a static after the declared ones, so
+      # later evaluations push the same String object
+      if string not in self.strings:
+        self.strings[string] = self.classSymbols.varCount('static') + len(self.strings)
+      index = self.strings[string]
+      ready = self.createLabel('string')
+      self.writer.writePush('static', index)
+      self.writer.writeIf(ready)
+      self.buildString(string)
+      self.writer.writePop('static', index)
+      self.writer.writeLabel(ready)
+      self.writer.writePush('static', index)
+    else:
+      self.buildString(string)
+
+  def buildString(self, string):
+    self.writer.writePush('constant', len(string))
+    self.writer.writeCall('String.new', 1)
+    for c in string:
+      self.writer.writePush('constant', ord(c))
+      self.writer.writeCall('String.appendChar', 2)
+
   def remember(self, identifier):
-    table = self.subSymbols if self.subSymbols.typeOf(identifier) else self.classSymbols
-    return (table.kindOf(identifier), table.indexOf(identifier), table.typeOf(identifier))
+    return self.subSymbols.resolve(identifier)
 
   def compileClass(self):
     self.classSymbols.reset()
-    json = self.analyzer.compileClass()
-    className = json['class'][1]['identifier']
-    for i in json['class']:
-      if 'subroutineDec' in i:
-        self.compileSubroutine(i['subroutineDec'], className)
-      elif 'classVarDec' in i:
-        self.compileClassVarDec(i['classVarDec'])
+    node = self.analyzer.compileClass()
+    if self.optimize:
+      ExpressionOptimizer().visit(node)
+    self.className = node.name
+    for i in node.classVarDecs:
+      self.compileClassVarDec(i)
+    for i in node.subroutines:
+      self.compileSubroutine(i, node.name)
 
   def compileClassVarDec(self, varDec):
-    kind = varDec[0]['keyword']
-    type = varDec[1].get('keyword') or varDec[1]['identifier']
-    for i in varDec[2:]:
-      if 'identifier' in i:
-        self.classSymbols.define(i['identifier'], type, kind)
-    
+    for name in varDec.names:
+      self.classSymbols.define(name, varDec.type, varDec.kind)
+
   def compileSubroutine(self, subroutine, className):
     self.subSymbols.reset()
-    subType = subroutine[0]['keyword']
-    params = self.compileParameterList(subroutine[4]['parameterList'])
-    body = subroutine[6]['subroutineBody']
-    for i in body:
-      if 'varDec' in i:
-        self.compileVarDec(i['varDec'])
-      elif 'statements' in i:
-        locals = self.subSymbols.varCount('local')
-        self.writer.writeFunction(f'{className}.{subroutine[2]["identifier"]}', locals)
-        if subType == 'method':
-          self.subSymbols.define('this', className, 'argument')
-          self.writer.writePush('argument', 0)
-          self.writer.writePop('pointer', 0)
-        elif subType == 'constructor':
-          self.subSymbols.define('this', className, 'pointer')
-          self.writer.writePush('constant', params + len(self.classSymbols.table))
-          self.writer.writeCall('Memory.alloc', 1)
-          self.writer.writePop('pointer', 0)
-        self.compileStatements(i['statements'])
-        break
-
-  def compileParameterList(self, parameterList):
-    count = 0
-    for i in range(0, len(parameterList), 3):
-      self.subSymbols.define(parameterList[i+1]['identifier'], parameterList[i].get('keyword') or parameterList[i]['identifier'], 'argument')
-      count += 1
-    return count
+    if subroutine.kind == 'method':
+      # The object is argument 0, ahead of the declared parameters
+      self.subSymbols.define('this', className, 'argument')
+    params = self.compileParameterList(subroutine.parameters)
+    self.subroutines[subroutine.name] = [subroutine.kind, params]
+    for i in subroutine.varDecs:
+      self.compileVarDec(i)
+    locals = self.subSymbols.varCount('local')
+    self.writer.writeFunction(f'{className}.{subroutine.name}', locals)
+    if subroutine.kind == 'method':
+      self.writer.writePush('argument', 0)
+      self.writer.writePop('pointer', 0)
+    elif subroutine.kind == 'constructor':
+      self.subSymbols.define('this', className, 'pointer')
+      self.writer.writePush('constant', self.classSymbols.varCount('field'))
+      self.writer.writeCall('Memory.alloc', 1)
+      self.writer.writePop('pointer', 0)
+    self.compileStatements(subroutine.statements)
+
+  def compileParameterList(self, parameters):
+    for i in parameters:
+      self.subSymbols.define(i.name, i.type, 'argument')
+    return len(parameters)
 
   def compileVarDec(self, varDec):
-    type = varDec[1].get('keyword') or varDec[1]['identifier']
-    for i in varDec[2:]:
-      if 'identifier' in i:
-        self.subSymbols.define(i['identifier'], type, 'local')
-        
-    
+    for name in varDec.names:
+      self.subSymbols.define(name, varDec.type, 'local')
+
   def compileStatements(self, statements):
     for i in statements:
-      if 'letStatement' in i:
-        self.compileLet(i['letStatement'])
-      elif 'ifStatement' in i:
-        self.compileIf(i['ifStatement'])
-      elif 'whileStatement' in i:
-        self.compileWhile(i['whileStatement'])
-      elif 'doStatement' in i:
-        self.compileDo(i['doStatement'])
-      elif 'returnStatement' in i:
-        self.compileReturn(i['returnStatement'])
+      if isinstance(i, Let):
+        self.compileLet(i)
+      elif isinstance(i, If):
+        self.compileIf(i)
+      elif isinstance(i, While):
+        self.compileWhile(i)
+      elif isinstance(i, Do):
+        self.compileDo(i)
+      elif isinstance(i, Return):
+        self.compileReturn(i)
 
   def compileLet(self, let):
-    identifier = let[1]['identifier']
-    expression = let[3]['expression']
-    var = self.remember(identifier)
-    self.compileExpression(expression)
-    if let[2].get('symbol') == '[':
+    var = self.remember(let.name)
+    if let.index is not None:
+      self.compileExpression(let.index)
       self.writer.writePush(var[0], var[1])
       self.writer.writeArithmetic('+')
-      self.compileExpression(let[6]['expression'])
+      self.compileExpression(let.value)
       self.writer.writePop('temp', 0)
       self.writer.writePop('pointer', 1)
       self.writer.writePush('temp', 0)
       self.writer.writePop('that', 0)
     else:
+      self.compileExpression(let.value)
       self.writer.writePop(var[0], var[1])
 
   def compileIf(self, ifStatement):
     endLabel = self.createLabel('ifend')
     elseLabel = self.createLabel('else')
-    self.compileExpression(ifStatement[2]['expression'])
+    self.compileExpression(ifStatement.condition)
     self.writer.writeUnary('~')
     self.writer.writeIf(elseLabel)
-    self.compileStatements(ifStatement[5]['statements'])
+    self.compileStatements(ifStatement.statements)
     self.writer.writeGoto(endLabel)
     self.writer.writeLabel(elseLabel)
-    if len(ifStatement) > 7:
-      self.compileStatements(ifStatement[9]['statements'])
+    if ifStatement.elseStatements is not None:
+      self.compileStatements(ifStatement.elseStatements)
     self.writer.writeLabel(endLabel)
 
   def compileWhile(self, whileStatement):
     continueLabel = self.createLabel('while')
     terminatelabel = self.createLabel('while_end')
     self.writer.writeLabel(continueLabel)
-    self.compileExpression(whileStatement[2]['expression'])
+    self.compileExpression(whileStatement.condition)
     self.writer.writeUnary('~')
     self.writer.writeIf(terminatelabel)
-    self.compileStatements(whileStatement[5]['statements'])
+    self.compileStatements(whileStatement.statements)
     self.writer.writeGoto(continueLabel)
     self.writer.writeLabel(terminatelabel)
 
   def compileCall(self, call):
-    callee = call[0]["identifier"] if call[1].get('symbol') == '.' else 'this'
-    method = call[2]['identifier'] if call[1].get('symbol') == '.' else call[0]['identifier']
-    exprs = [x for x in call if 'expressionList' in x][0]
+    callee = call.receiver or 'this'
     size = 0
     if callee[0].islower():
       var = self.remember(callee)
       callee = var[2]
       self.writer.writePush(var[0], var[1])
       size += 1
-    size += self.compileExpressionList(exprs)
-    self.writer.writeCall(f'{callee}.{method}', size)
+    size += self.compileExpressionList(call.arguments)
+    self.writer.writeCall(f'{callee}.{call.name}', size)
 
   def compileDo(self, do):
-    call = do[1]
-    self.compileCall(call)
+    self.compileCall(do.call)
     self.writer.writePop('temp', 0)
 
   def compileReturn(self, returnStatement):
-    expression = returnStatement[1]
-    if 'expression' in expression:
-      self.compileExpression(expression['expression'])
+    if returnStatement.value is not None:
+      self.compileExpression(returnStatement.value)
     else:
       self.writer.writePush('constant', 0)
     self.writer.writeReturn()
 
   def compileExpression(self, expr):
-    symbol = None
-    for i in expr:
-      if 'symbol' in i:
-        symbol = i['symbol']
-      elif symbol:
-        self.compileTerm(i['term'])
-        self.writer.writeArithmetic(symbol)
-        symbol = None
-      else:
-        self.compileTerm(i['term'])
+    if isinstance(expr, BinaryOp):
+      self.compileExpression(expr.left)
+      self.compileExpression(expr.right)
+      self.writer.writeArithmetic(expr.op)
+    else:
+      self.compileTerm(expr)
 
   def compileTerm(self, term):
-    if not isinstance(term, list):
-      if 'identifier' in term:
-        var = self.remember(term['identifier'])
-        self.writer.writePush(var[0], var[1])
-      elif term.get('keyword') == 'this':
+    if isinstance(term, Variable):
+      var = self.remember(term.name)
+      self.writer.writePush(var[0], var[1])
+    elif isinstance(term, IntegerConstant):
+      # Folded constants may be negative
+      if term.value == -0x8000:
+        self.writer.writePush('constant', 0x7fff)
+        self.writer.writeUnary('~')
+      elif term.value < 0:
+        self.writer.writePush('constant', -term.value)
+        self.writer.writeUnary('-')
+      else:
+        self.writer.writePush('constant', term.value)
+    elif isinstance(term, KeywordConstant):
+      if term.value == 'this':
         self.writer.writePush('pointer', 0)
-      elif term.get('stringConstant'):
-        string = term['stringConstant']
-        self.writer.writePush('constant', len(string))
-        self.writer.writeCall('String.new', 1)
-        for c in string:
-          self.writer.writePush('constant', ord(c))
-          self.writer.writeCall('String.appendChar', 2)
       else:
-        self.push(term)
-    elif term[0].get('symbol') == '(':
-      self.compileExpression(term[1]['expression'])
-    elif term[0].get('symbol'):
-      self.compileTerm(term[1]['term'])
-      self.writer.writeUnary(term[0]['symbol'])
-    elif term[1].get('symbol') == '[':
-      var = self.remember(term[0]['identifier'])
+        self.writer.writePush('constant', 0)
+        if term.value == 'true':
+          self.writer.writeUnary('~')
+    elif isinstance(term, StringConstant):
+      if term.value:
+        self.compileString(term.value)
+    elif isinstance(term, Group):
+      self.compileExpression(term.expression)
+    elif isinstance(term, UnaryOp):
+      self.compileExpression(term.operand)
+      self.writer.writeUnary(term.op)
+    elif isinstance(term, ShiftLeft):
+      # Doubles by adding the value to itself, with temp 1 standing in for dup
+      count = term.count
+      if isinstance(term.operand, Variable):
+        var = self.remember(term.operand.name)
+        self.writer.writePush(var[0], var[1])
+        self.writer.writePush(var[0], var[1])
+        self.writer.writeArithmetic('+')
+        count -= 1
+      else:
+        self.compileExpression(term.operand)
+      for _ in range(count):
+        self.writer.writePop('temp', 1)
+        self.writer.writePush('temp', 1)
+        self.writer.writePush('temp', 1)
+        self.writer.writeArithmetic('+')
+    elif isinstance(term, ArrayAccess):
+      var = self.remember(term.name)
       self.writer.writePush(var[0], var[1])
-      self.compileExpression(term[2]['expression'])
+      self.compileExpression(term.index)
       self.writer.writeArithmetic('+')
       self.writer.writePop('pointer', 1)
       self.writer.writePush('that', 0)
     else:
       self.compileCall(term)
-    
-  def push(self, item):
-    if 'varName' in item:
-      variable = item['varName']
-      if self.subSymbols.kindOf(variable):
-        self.writer.writePush(self.subSymbols.kindOf(variable), self.subSymbols.indexOf(variable))
+
+  def compileExpressionList(self, exprs):
+    for i in exprs:
+      self.compileExpression(i)
+    return len(exprs)
+
+class DirectCompilationEngine(CompilationEngine):
+  # Emits VM code while parsing, instead of walking the analyzer's tree.
+  # Symbols are looked up in the same order, so the output is identical
+  def __init__(self, filename, intern_strings=False):
+    super().__init__(filename, intern_strings=intern_strings)
+    self.tokenizer = self.analyzer.tokenizer
+
+  def next(self):
+    self.tokenizer.advance()
+    return self.tokenizer.token
+
+  def compileClass(self):
+    self.classSymbols.reset()
+    self.next() # class
+    className = self.className = self.next()
+    self.next() # {
+    while (peek := self.tokenizer.peek()) != '}':
+      if peek in ['field', 'static']:
+        self.compileClassVarDec()
+      elif peek in ['constructor', 'function', 'method']:
+        self.compileSubroutine(className)
+      else:
+        raise self.tokenizer.unexpected()
+
+  def compileClassVarDec(self):
+    kind = self.next()
+    type = self.next()
+    self.classSymbols.define(self.next(), type, kind)
+    while self.next() == ',':
+      self.classSymbols.define(self.next(), type, kind)
+
+  def compileSubroutine(self, className):
+    self.subSymbols.reset()
+    subType = self.next()
+    self.next() # Return type
+    name = self.next()
+    self.next() # (
+    if subType == 'method':
+      self.subSymbols.define('this', className, 'argument')
+    params = self.compileParameterList()
+    self.subroutines[name] = [subType, params]
+    self.next() # {
+    while self.tokenizer.peek() == 'var':
+      self.compileVarDec()
+    self.writer.writeFunction(f'{className}.{name}', self.subSymbols.varCount('local'))
+    if subType == 'method':
+      self.writer.writePush('argument', 0)
+      self.writer.writePop('pointer', 0)
+    elif subType == 'constructor':
+      self.subSymbols.define('this', className, 'pointer')
+      self.writer.writePush('constant', self.classSymbols.varCount('field'))
+      self.writer.writeCall('Memory.alloc', 1)
+      self.writer.writePop('pointer', 0)
+    self.compileStatements()
+    self.next() # }
+
+  def compileParameterList(self):
+    count = 0
+    while self.tokenizer.peek() != ')':
+      type = self.next()
+      self.subSymbols.define(self.next(), type, 'argument')
+      count += 1
+      if self.next() != ',':
+        return count
+    self.next() # )
+    return count
+
+  def compileVarDec(self):
+    self.next() # var
+    type = self.next()
+    self.subSymbols.define(self.next(), type, 'local')
+    while self.next() == ',':
+      self.subSymbols.define(self.next(), type, 'local')
+
+  def compileStatements(self):
+    while (peek := self.tokenizer.peek()) != '}':
+      if peek == 'do':
+        self.compileDo()
+      elif peek == 'let':
+        self.compileLet()
+      elif peek == 'while':
+        self.compileWhile()
+      elif peek == 'if':
+        self.compileIf()
+      elif peek == 'return':
+        self.compileReturn()
       else:
-        self.writer.writePush(self.classSymbols.kindOf(variable), self.classSymbols.indexOf(variable))
-    elif 'integerConstant' in item:
-      self.writer.writePush('constant', item['integerConstant'])
-    elif 'keyword' in item:
+        raise self.tokenizer.unexpected('statement token')
+
+  def compileLet(self):
+    self.next() # let
+    var = self.remember(self.next())
+    if self.tokenizer.peek() == '[':
+      self.next() # [
+      self.compileExpression()
+      self.next() # ]
+      self.next() # =
+      self.writer.writePush(var[0], var[1])
+      self.writer.writeArithmetic('+')
+      self.compileExpression()
+      self.next() # ;
+      self.writer.writePop('temp', 0)
+      self.writer.writePop('pointer', 1)
+      self.writer.writePush('temp', 0)
+      self.writer.writePop('that', 0)
+    else:
+      self.next() # =
+      self.compileExpression()
+      self.next() # ;
+      self.writer.writePop(var[0], var[1])
+
+  def compileIf(self):
+    endLabel = self.createLabel('ifend')
+    elseLabel = self.createLabel('else')
+    self.next() # if
+    self.next() # (
+    self.compileExpression()
+    self.next() # )
+    self.next() # {
+    self.writer.writeUnary('~')
+    self.writer.writeIf(elseLabel)
+    self.compileStatements()
+    self.next() # }
+    self.writer.writeGoto(endLabel)
+    self.writer.writeLabel(elseLabel)
+    if self.tokenizer.peek() == 'else':
+      self.next() # else
+      self.next() # {
+      self.compileStatements()
+      self.next() # }
+    self.writer.writeLabel(endLabel)
+
+  def compileWhile(self):
+    continueLabel = self.createLabel('while')
+    terminatelabel = self.createLabel('while_end')
+    self.writer.writeLabel(continueLabel)
+    self.next() # while
+    self.next() # (
+    self.compileExpression()
+    self.next() # )
+    self.next() # {
+    self.writer.writeUnary('~')
+    self.writer.writeIf(terminatelabel)
+    self.compileStatements()
+    self.next() # }
+    self.writer.writeGoto(continueLabel)
+    self.writer.writeLabel(terminatelabel)
+
+  def compileCall(self, name):
+    if self.tokenizer.peek() == '.':
+      self.next() # .
+      callee, method = name, self.next()
+    else:
+      callee, method = 'this', name
+    size = 0
+    if callee[0].islower():
+      var = self.remember(callee)
+      callee = var[2]
+      self.writer.writePush(var[0], var[1])
+      size += 1
+    self.next() # (
+    size += self.compileExpressionList()
+    self.next() # )
+    self.writer.writeCall(f'{callee}.{method}', size)
+
+  def compileDo(self):
+    self.next() # do
+    self.compileCall(self.next())
+    self.next() # ;
+    self.writer.writePop('temp', 0)
+
+  def compileReturn(self):
+    self.next() # return
+    if self.tokenizer.peek() != ';':
+      self.compileExpression()
+    else:
+      self.writer.writePush('constant', 0)
+    self.next() # ;
+    self.writer.writeReturn()
+
+  def compileExpression(self):
+    self.compileTerm()
+    while self.tokenizer.peek() in ['+', '-', '*', '/', '&', '|', '<', '>', '=']:
+      op = self.next()
+      self.compileTerm()
+      self.writer.writeArithmetic(op)
+
+  def compileTerm(self):
+    token = self.next()
+    type = self.tokenizer.tokenType()
+    if token == '(':
+      self.compileExpression()
+      self.next() # )
+    elif token in ['-', '~']:
+      self.compileTerm()
+      self.writer.writeUnary(token)
+    elif self.tokenizer.peek() == '[':
+      var = self.remember(token)
+      self.writer.writePush(var[0], var[1])
+      self.next() # [
+      self.compileExpression()
+      self.next() # ]
+      self.writer.writeArithmetic('+')
+      self.writer.writePop('pointer', 1)
+      self.writer.writePush('that', 0)
+    elif self.tokenizer.peek() in ['(', '.']:
+      self.compileCall(token)
+    elif type == 'identifier':
+      var = self.remember(token)
+      self.writer.writePush(var[0], var[1])
+    elif token == 'this':
+      self.writer.writePush('pointer', 0)
+    elif type == 'stringConstant' and token[1:]:
+      self.compileString(token[1:])
+    elif type == 'integerConstant':
+      self.writer.writePush('constant', int(token))
+    elif type == 'keyword':
       self.writer.writePush('constant', 0)
-      if item['keyword'] == 'true':
+      if token == 'true':
         self.writer.writeUnary('~')
 
-  def compileExpressionList(self, exprs):
-    size = 0
-    for exp in exprs['expressionList']:
-      if 'expression' in exp:
-        self.compileExpression(exp['expression'])
-        size += 1
+  def compileExpressionList(self):
+    if self.tokenizer.peek() == ')':
+      return 0
+    self.compileExpression()
+    size = 1
+    while self.tokenizer.peek() == ',':
+      self.next() # ,
+      self.compileExpression()
+      size += 1
     return size
 
+def compile_file(filename, direct=False, optimize=False, intern_strings=False):
+  # Returns an error message, or the class signature once the .vm file is
+  # written, along with the symbol lookup counts
+  compiler = None
+  try:
+    if direct:
+      compiler = DirectCompilationEngine(filename, intern_strings)
+    else:
+      compiler = CompilationEngine(filename, optimize, intern_strings)
+    compiler.compileClass()
+  except Exception as e:
+    if compiler is not None:
+      compiler.writer.discard()
+    return f'{filename}: {type(e).__name__}: {e}', None, (0, 0)
+  compiler.writer.close()
+  symbols = compiler.subSymbols
+  return None, compiler.signature(), (symbols.lookups, symbols.misses)
+
+def jack_files(paths):
+  # Expands directories and glob patterns into .jack files
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.jack'))
+    elif glob.has_magic(path):
+      files += sorted(glob.glob(path))
+    else:
+      files.append(path)
+  return files
+
+def stale(filename, stamp):
+  # Like make: the .vm file is missing or older than its source, or was
+  # compiled by another compiler version or with other options
+  outfile = filename.replace('.jack', '.vm')
+  try:
+    if os.path.getmtime(outfile) < os.path.getmtime(filename):
+      return True
+    with open(outfile + '.stamp', 'r') as f:
+      return f.read() != stamp
+  except OSError:
+    # A missing source is also compiled, so its error is reported
+    return True
+
+def replace_file(path, text):
+  with open(path + '.tmp', 'w') as f:
+    f.write(text)
+  os.replace(path + '.tmp', path)
+
+class CompileCache:
+  # Compiled classes on disk, keyed by source content, compiler version
+  # and options. The output does not depend on the file name
+  def __init__(self, directory, *options):
+    self.directory = directory
+    self.options = options
+    os.makedirs(directory, exist_ok=True)
+
+  def path(self, filename):
+    # None when the source cannot be read; compiling it reports the error
+    try:
+      with open(filename, 'rb') as f:
+        digest = hashlib.sha256(f.read())
+    except OSError:
+      return None
+    digest.update(repr((VERSION, self.options)).encode())
+    return os.path.join(self.directory, f'{digest.hexdigest()}.json')
+
+  def load(self, path):
+    if path is None or not os.path.exists(path):
+      return None
+    with open(path, 'r') as f:
+      return json.load(f)
+
+  def store(self, path, vm, signature):
+    replace_file(path, json.dumps({'vm': vm, 'signature': signature}))
+
+class JackCompiler:
+  def __init__(self, paths, direct=False, jobs=1, cache=None, make=False, optimize=False, intern_strings=False):
+    self.files = jack_files(paths)
+    self.direct = direct
+    self.optimize = optimize
+    self.intern_strings = intern_strings
+    self.jobs = jobs
+    self.cache = CompileCache(cache, direct, optimize, intern_strings) if cache else None
+    self.make = make
+    # What the .vm files depend on besides the source, recorded next to
+    # each one for --make
+    self.stamp = json.dumps([VERSION, direct, optimize, intern_strings])
+    self.signatures = {}
+    self.lookups = 0
+    self.misses = 0
+    self.compiled = 0
+    self.cached = 0
+    self.skipped = 0
+
+  def compile(self):
+    # Error messages of the files that failed, in file order
+    files = [f for f in self.files if stale(f, self.stamp)] if self.make else self.files
+    self.skipped = len(self.files) - len(files)
+    if self.cache:
+      paths = {f: self.cache.path(f) for f in files}
+      missing = []
+      for f in files:
+        entry = self.cache.load(paths[f])
+        if entry is None:
+          missing.append(f)
+        else:
+          replace_file(f.replace('.jack', '.vm'), entry['vm'])
+          self.signatures[f] = entry['signature']
+          self.written(f)
+      self.cached = len(files) - len(missing)
+      files = missing
+    errors = []
+    for f, (error, signature, (lookups, misses)) in zip(files, self.compile_all(files)):
+      self.lookups += lookups
+      self.misses += misses
+      if error:
+        errors.append(error)
+        continue
+      self.compiled += 1
+      self.signatures[f] = signature
+      self.written(f)
+      if self.cache and paths[f]:
+        with open(f.replace('.jack', '.vm'), 'r') as vm:
+          self.cache.store(paths[f], vm.read(), signature)
+    return errors
+
+  def written(self, filename):
+    replace_file(filename.replace('.jack', '.vm') + '.stamp', self.stamp)
+
+  def compile_all(self, files):
+    options = [[option] * len(files) for option in (self.direct, self.optimize, self.intern_strings)]
+    if self.jobs == 1 or len(files) <= 1:
+      return list(map(compile_file, files, *options))
+    with ProcessPoolExecutor(self.jobs) as executor:
+      return list(executor.map(compile_file, files, *options))
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Compiler')
-  parser.add_argument('filename', help='input file')
+  parser.add_argument('paths', nargs='+', help='.jack files, directories or glob patterns')
+  parser.add_argument('--direct', action='store_true', help='emit VM code while parsing, without building a parse tree')
+  parser.add_argument('--jobs', type=int, default=1, help='compile the files in this many processes')
+  parser.add_argument('--cache', metavar='DIRECTORY', help='reuse compilations of unchanged classes from this directory')
+  parser.add_argument('--make', action='store_true', help='skip classes whose .vm file is newer than the source and was compiled with the same version and options')
+  parser.add_argument('--optimize', action='store_true', help='fold constants and simplify expressions')
+  parser.add_argument('--stats', action='store_true', help='print symbol table lookup counts and the compile time')
+  parser.add_argument('--intern-strings', action='store_true', help='build each string literal once and reuse it; the program must not modify or dispose literals')
   args = parser.parse_args()
-  compiler = CompilationEngine(args.filename)
-  compiler.compileClass()
+  if args.direct and args.optimize:
+    parser.error('--optimize works on the parse tree, so it cannot be combined with --direct')
+  compiler = JackCompiler(args.paths, args.direct, args.jobs, args.cache, args.make, args.optimize, args.intern_strings)
+  start = time.perf_counter()
+  errors = compiler.compile()
+  elapsed = time.perf_counter() - start
+  for error in errors:
+    print(error, file=sys.stderr)
+  if args.cache or args.make:
+    print(f'Compiled {compiler.compiled}, reused {compiler.cached} cached, skipped {compiler.skipped} up to date')
+  if args.stats:
+    print(f'{compiler.lookups} symbol lookups ({compiler.misses} unresolved) in {elapsed:.3f} s, {compiler.lookups / elapsed:.0f} lookups/s')
+  if errors:
+    sys.exit(1)
@@ -0,0 +1,84 @@
+# Jack abstract syntax tree. Types, names and operators are plain strings;
+# the fixed punctuation of the grammar is not stored
+class Node:
+  __slots__ = ()
+
+  def __init__(self, *args):
+    for name, value in zip(self.__slots__, args):
+      setattr(self, name, value)
+
+  def __repr__(self):
+    fields = ', '.join(repr(getattr(self, name)) for name in self.__slots__)
+    return f'{type(self).__name__}({fields})'
+
+class Class(Node):
+  __slots__ = ('name', 'classVarDecs', 'subroutines')
+
+class ClassVarDec(Node):
+  __slots__ = ('kind', 'type', 'names')
+
+class Subroutine(Node):
+  __slots__ = ('kind', 'returnType', 'name', 'parameters', 'varDecs', 'statements')
+
+class Parameter(Node):
+  __slots__ = ('type', 'name')
+
+class VarDec(Node):
+  __slots__ = ('type', 'names')
+
+# Statements
+class Let(Node):
+  # index is None unless assigning to an array element
+  __slots__ = ('name', 'index', 'value')
+
+class If(Node):
+  # elseStatements is None without an else branch
+  __slots__ = ('condition', 'statements', 'elseStatements')
+
+class While(Node):
+  __slots__ = ('condition', 'statements')
+
+class Do(Node):
+  __slots__ = ('call',)
+
+class Return(Node):
+  __slots__ = ('value',)
+
+# Expressions
+class BinaryOp(Node):
+  # Jack has no precedence, so a chain a + b * c nests to the left
+  __slots__ = ('op', 'left', 'right')
+
+class UnaryOp(Node):
+  __slots__ = ('op', 'operand')
+
+class Group(Node):
+  # A parenthesized expression
+  __slots__ = ('expression',)
+
+class IntegerConstant(Node):
+  __slots__ = ('value',)
+
+class StringConstant(Node):
+  __slots__ = ('value',)
+
+class KeywordConstant(Node):
+  __slots__ = ('value',)
+
+class Variable(Node):
+  __slots__ = ('name',)
+
+class ArrayAccess(Node):
+  __slots__ = ('name', 'index')
+
+class ShiftLeft(Node):
+  # operand * 2**count; only produced by the optimizer
+  __slots__ = ('operand', 'count')
+
+class Call(Node):
+  # receiver is None for calls without a class or variable name
+  __slots__ = ('receiver', 'name', 'arguments')
+
+class Visitor:
+  def visit(self, node):
+    return getattr(self, 'visit' + type(node).__name__)(node)
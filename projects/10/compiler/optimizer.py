@@ -0,0 +1,178 @@
+from nodes import BinaryOp, UnaryOp, IntegerConstant, KeywordConstant, ArrayAccess, ShiftLeft, Call, Visitor
+
+def wrap(value):
+  return (value + 0x8000) % 0x10000 - 0x8000
+
+def constant(node):
+  # The value of a constant expression, or None
+  if isinstance(node, IntegerConstant):
+    return node.value
+  if isinstance(node, KeywordConstant) and node.value != 'this':
+    return -1 if node.value == 'true' else 0
+  return None
+
+def pure(node):
+  # Evaluating it cannot have side effects, so it may be dropped
+  if isinstance(node, Call):
+    return False
+  if isinstance(node, BinaryOp):
+    return pure(node.left) and pure(node.right)
+  if isinstance(node, (UnaryOp, ShiftLeft)):
+    return pure(node.operand)
+  if isinstance(node, ArrayAccess):
+    return pure(node.index)
+  return True
+
+def fold(op, a, b):
+  # 16-bit arithmetic, with comparisons giving true (-1) or false (0)
+  if op == '+':
+    return wrap(a + b)
+  if op == '-':
+    return wrap(a - b)
+  if op == '*':
+    return wrap(a * b)
+  if op == '/':
+    # Math.divide truncates towards zero
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+  if op == '&':
+    return a & b
+  if op == '|':
+    return a | b
+  if op == '<':
+    return -(a < b)
+  if op == '>':
+    return -(a > b)
+  return -(a == b)
+
+class ExpressionOptimizer(Visitor):
+  # Folds constants, simplifies identities and turns multiplication by a
+  # power of two into additions. Operands are still evaluated left to right,
+  # and one is only dropped when it contains no calls
+  def visitClass(self, node):
+    for i in node.subroutines:
+      self.visit(i)
+
+  def visitSubroutine(self, node):
+    self.statements(node.statements)
+
+  def statements(self, statements):
+    for i in statements:
+      self.visit(i)
+
+  def visitLet(self, node):
+    if node.index is not None:
+      node.index = self.visit(node.index)
+    node.value = self.visit(node.value)
+
+  def visitIf(self, node):
+    node.condition = self.visit(node.condition)
+    self.statements(node.statements)
+    if node.elseStatements is not None:
+      self.statements(node.elseStatements)
+
+  def visitWhile(self, node):
+    node.condition = self.visit(node.condition)
+    self.statements(node.statements)
+
+  def visitDo(self, node):
+    self.visit(node.call)
+
+  def visitReturn(self, node):
+    if node.value is not None:
+      node.value = self.visit(node.value)
+
+  # Expressions return their replacement
+  def visitIntegerConstant(self, node):
+    return node
+
+  def visitStringConstant(self, node):
+    return node
+
+  def visitKeywordConstant(self, node):
+    return node
+
+  def visitVariable(self, node):
+    return node
+
+  def visitArrayAccess(self, node):
+    node.index = self.visit(node.index)
+    return node
+
+  def visitCall(self, node):
+    node.arguments = [self.visit(x) for x in node.arguments]
+    return node
+
+  def visitGroup(self, node):
+    # The tree already fixes the evaluation order
+    return self.visit(node.expression)
+
+  def visitUnaryOp(self, node):
+    operand = self.visit(node.operand)
+    value = constant(operand)
+    if value is not None:
+      return IntegerConstant(wrap(-value) if node.op == '-' else ~value)
+    if isinstance(operand, UnaryOp) and operand.op == node.op:
+      return operand.operand
+    node.operand = operand
+    return node
+
+  def visitBinaryOp(self, node):
+    op = node.op
+    left = self.visit(node.left)
+    right = self.visit(node.right)
+    a, b = constant(left), constant(right)
+    if a is not None and b is not None:
+      if op == '/' and (b == 0 or a == -0x8000 or b == -0x8000):
+        # Left to Math.divide, which reports division by zero
+        return BinaryOp(op, left, right)
+      return IntegerConstant(fold(op, a, b))
+    if a is not None and op in ['+', '*', '&', '|']:
+      # Constants are pure, so pushing one after the other operand is the same
+      left, right, b = right, left, a
+    elif a is not None:
+      if op == '-' and a == 0:
+        return UnaryOp('-', right)
+      return BinaryOp(op, left, right)
+    if b is None:
+      return BinaryOp(op, left, right)
+    if op in ['+', '-']:
+      return self.offset(left, b if op == '+' else -b)
+    if op == '*':
+      if b == 1:
+        return left
+      if b == 0 and pure(left):
+        return IntegerConstant(0)
+      if b == -1:
+        return UnaryOp('-', left)
+      if b > 1 and b & (b - 1) == 0:
+        count = b.bit_length() - 1
+        if isinstance(left, ShiftLeft):
+          return ShiftLeft(left.operand, left.count + count)
+        return ShiftLeft(left, count)
+    elif op == '/':
+      if b == 1:
+        return left
+    elif op == '&':
+      if b == -1:
+        return left
+      if b == 0 and pure(left):
+        return IntegerConstant(0)
+    elif op == '|':
+      if b == 0:
+        return left
+      if b == -1 and pure(left):
+        return IntegerConstant(-1)
+    return BinaryOp(op, left, IntegerConstant(b))
+
+  def offset(self, node, value):
+    # node + value, merged with a constant already added to node
+    if isinstance(node, BinaryOp) and node.op in ['+', '-'] and isinstance(node.right, IntegerConstant):
+      value += node.right.value if node.op == '+' else -node.right.value
+      node = node.left
+    value = wrap(value)
+    if value == 0:
+      return node
+    if 0 < value or value == -0x8000:
+      return BinaryOp('+', node, IntegerConstant(value))
+    return BinaryOp('-', node, IntegerConstant(-value))
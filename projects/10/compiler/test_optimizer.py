@@ -0,0 +1,140 @@
+import os
+import random
+import re
+import subprocess
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(HERE)))
+COMPILER = os.path.join(HERE, 'compiler.py')
+INTERPRETER = os.path.join(ROOT, 'projects', '07', 'translator', 'interpreter.py')
+OS = os.path.join(ROOT, 'tools', 'OS')
+STEPS = 2000000
+# Results are poked from here on; the call count and a marker go first
+RESULTS = 9000
+CALLS = RESULTS - 2
+DONE = RESULTS - 1
+
+# Each expression is evaluated in the same program with and without
+# --optimize. Main.f has a side effect, so a dropped or reordered call
+# changes every later result
+CASES = [
+  # 0 - x becomes a neg
+  '0 - a',
+  '0 - Main.f(b)',
+  '0 - (a + b)',
+  # Multiplication by a power of two on things other than a variable
+  '(a + b) * 8',
+  'arr[1] * 4',
+  'Main.f(b) * 16',
+  '(a - 1) * 2 * 2',
+  '2 * (b & 255)',
+  '-a * 1024',
+  '(Main.f(a) * 2) * 8',
+  'arr[Main.f(0) & 3] * 32',
+  # Folding at the edge of the 16-bit range
+  '32767 + 1',
+  '-32767 - 1',
+  '16384 * 2',
+  '-(32767 + 1)',
+  '-32767 - 1 - 1',
+  '(32767 + 1) / 2',
+  'a + 32767 + 1',
+  'a - 32767 - 1',
+  # A zero multiple of a call still makes the call
+  'Main.f(a) * 0',
+  '0 * Main.f(b)',
+  '(Main.f(a) + 1) & 0',
+  'Main.f(c) | -1',
+  '(arr[2] + Main.f(1)) * 0',
+]
+# The folds that must give -32768
+MINIMUM = ['32767 + 1', '-32767 - 1', '16384 * 2', '-(32767 + 1)']
+
+OPERATORS = ['+', '-', '*', '/', '&', '|', '<', '>', '=']
+
+def constant(rng):
+  return rng.choice(['0', '1', '2', '4', '8', '16', '3', '1024', '32767', '16384', 'true', 'false', 'null', str(rng.randint(0, 32767))])
+
+def term(rng, depth):
+  r = rng.random()
+  if depth <= 0 or r < 0.3:
+    return rng.choice(['a', 'b', 'c', constant(rng), constant(rng)])
+  if r < 0.45:
+    return rng.choice(['-', '~']) + term(rng, depth - 1)
+  if r < 0.55:
+    return f'Main.f({expression(rng, depth - 1)})'
+  if r < 0.62:
+    return f'arr[{rng.randint(0, 3)}]'
+  return f'({expression(rng, depth - 1)})'
+
+def expression(rng, depth):
+  result = term(rng, depth)
+  for _ in range(rng.randint(0, 3)):
+    op = rng.choice(OPERATORS)
+    operand = term(rng, depth)
+    if op == '/':
+      # Never divide by zero
+      operand = f'(Main.nonzero({operand}))'
+    result += f' {op} {operand}'
+  return result
+
+def program(expressions, a=37, b=-5, c=2):
+  pokes = '\n'.join(f'    do Memory.poke({RESULTS + i}, {e});' for i, e in enumerate(expressions))
+  return f'''class Main {{
+  static int calls;
+  function int f(int x) {{ let calls = calls + 1; return x + calls; }}
+  function int nonzero(int x) {{ if (x = 0) {{ return 7; }} return x; }}
+  function void main() {{
+    var int a, b, c;
+    var Array arr;
+    let arr = Array.new(4);
+    let arr[0] = 5; let arr[1] = -3; let arr[2] = 100; let arr[3] = 32767;
+    let a = {a}; let b = {b}; let c = {c};
+{pokes}
+    do Memory.poke({CALLS}, calls);
+    do Memory.poke({DONE}, 12345);
+    return;
+  }}
+}}
+'''
+
+def run(directory, source, count, *flags):
+  os.makedirs(directory)
+  with open(os.path.join(directory, 'Main.jack'), 'w') as f:
+    f.write(source)
+  subprocess.run([sys.executable, COMPILER, directory, *flags], check=True, capture_output=True)
+  addresses = [str(i) for i in range(CALLS, RESULTS + count)]
+  output = subprocess.run(
+    [sys.executable, INTERPRETER, directory, OS, '--steps', str(STEPS), '--dump', *addresses],
+    check=True, capture_output=True, text=True,
+  ).stdout
+  ram = {int(address): int(value) for address, value in re.findall(r'RAM\[(\d+)\] = (-?\d+)', output)}
+  assert ram[DONE] == 12345, 'the program did not finish'
+  with open(os.path.join(directory, 'Main.vm')) as f:
+    vm = f.read()
+  return [ram[i] for i in range(CALLS, RESULTS + count)], vm
+
+def compare(tmp_path, expressions):
+  source = program(expressions)
+  plain, plain_vm = run(str(tmp_path / 'plain'), source, len(expressions))
+  optimized, optimized_vm = run(str(tmp_path / 'optimized'), source, len(expressions), '--optimize')
+  for i, e in enumerate(expressions):
+    assert optimized[2 + i] == plain[2 + i], e
+  assert optimized[0] == plain[0], 'number of calls'
+  return optimized, plain_vm, optimized_vm
+
+def test_cases(tmp_path):
+  results, plain_vm, optimized_vm = compare(tmp_path, CASES)
+  for e in MINIMUM:
+    assert results[2 + CASES.index(e)] == -32768, e
+  # The powers of two no longer call Math.multiply
+  assert optimized_vm.count('call Math.multiply') < plain_vm.count('call Math.multiply')
+  assert 'neg' in optimized_vm
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_random(seed, tmp_path):
+  rng = random.Random(seed)
+  compare(tmp_path, [expression(rng, 3) for _ in range(40)])